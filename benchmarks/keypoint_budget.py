@@ -0,0 +1,90 @@
+"""
+Benchmark of the main image keypoint budget.
+
+Detects the features of the main image once, then for every budget and selection method measures:
+- the time of the selection, of the index build and of the template matching
+- the number of good matches, the inliers of the homography and the match rate (good matches per template keypoint)
+- the largest corner distance in pixels between the matched polygon and the polygon matched without budget
+
+Usage:
+    python benchmarks/keypoint_budget.py --main_image main.tif --template_image template.png [--budgets 5000 20000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feature_backends import get_feature_backend
+from keypoint_budget import apply_keypoint_budget, KEYPOINT_BUDGET_METHODS
+from template_matching_sift_based import (build_match_index, detect_features, detect_full_resolution_features,
+                                          find_template_homography, match_descriptors, project_template_polygon)
+from utils import load_gray_image
+
+def measure(backend, keypoints_main, descriptors_main, keypoints_template, descriptors_template, budget, method,
+            grid_size, robustness):
+    start = time.perf_counter()
+    keypoints, descriptors = apply_keypoint_budget(keypoints_main, descriptors_main, budget, method, grid_size, robustness)
+    select_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = build_match_index(descriptors, feature_backend=backend)
+    index_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    good_matches = match_descriptors(descriptors_template, descriptors, flann_index=index, feature_backend=backend)
+    match_time = time.perf_counter() - start
+
+    M, mask, _ = find_template_homography(keypoints_template, keypoints, good_matches)
+    return dict(keypoints=len(keypoints), select=select_time, index=index_time, match=match_time,
+                good=len(good_matches), inliers=int(mask.sum()) if M is not None else 0, M=M)
+
+def corner_error(M, reference_M, template_shape):
+    if M is None or reference_M is None:
+        return float("nan")
+    polygon = project_template_polygon(template_shape, M).reshape(-1, 2)
+    reference = project_template_polygon(template_shape, reference_M).reshape(-1, 2)
+    return float(np.linalg.norm(polygon - reference, axis=1).max())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of the main image keypoint budget')
+    parser.add_argument('--main_image', type=str, required=True, help='Main image file')
+    parser.add_argument('--template_image', type=str, required=True, help='Template image file')
+    parser.add_argument('--budgets', type=int, nargs='+', default=[2000, 5000, 20000], help='Keypoint budgets')
+    parser.add_argument('--methods', type=str, nargs='+', default=list(KEYPOINT_BUDGET_METHODS), help='Selection methods')
+    parser.add_argument('--feature_backend', type=str, default='sift', help='Feature backend')
+    parser.add_argument('--grid_size', type=int, default=16, help='Grid size of the grid method')
+    parser.add_argument('--robustness', type=float, default=0.9, help='Robustness of the anms method')
+    parser.add_argument('--memory_budget_bytes', type=int, default=None, help='Budget of the decoded main image')
+    args = parser.parse_args()
+
+    backend = get_feature_backend(args.feature_backend)
+    main_gray, main_scale = load_gray_image(args.main_image, args.memory_budget_bytes)
+    template_gray = cv2.imread(args.template_image, cv2.IMREAD_GRAYSCALE)
+    if backend is None or main_gray is None or template_gray is None:
+        sys.exit(1)
+
+    start = time.perf_counter()
+    keypoints_main, descriptors_main = detect_full_resolution_features(backend.create_detector(), main_gray, main_scale)
+    print(f"Main image: {len(keypoints_main)} keypoints in {time.perf_counter() - start:.2f} s")
+    keypoints_template, descriptors_template = detect_features(backend.create_detector(), template_gray)
+    print(f"Template: {len(keypoints_template)} keypoints")
+
+    reference = measure(backend, keypoints_main, descriptors_main, keypoints_template, descriptors_template,
+                        None, "grid", args.grid_size, args.robustness)
+    rows = [("none", "all", reference)]
+    for budget in args.budgets:
+        for method in args.methods:
+            rows.append((method, budget, measure(backend, keypoints_main, descriptors_main, keypoints_template,
+                                                 descriptors_template, budget, method, args.grid_size, args.robustness)))
+
+    print(f"{'method':<8}{'budget':>8}{'kept':>9}{'select s':>10}{'index s':>9}{'match s':>9}"
+          f"{'good':>7}{'inliers':>9}{'rate':>8}{'corner px':>11}")
+    for method, budget, result in rows:
+        rate = result['good'] / max(len(keypoints_template), 1)
+        error = corner_error(result['M'], reference['M'], template_gray.shape)
+        print(f"{method:<8}{budget:>8}{result['keypoints']:>9}{result['select']:>10.3f}{result['index']:>9.3f}"
+              f"{result['match']:>9.3f}{result['good']:>7}{result['inliers']:>9}{rate:>8.3f}{error:>11.1f}")
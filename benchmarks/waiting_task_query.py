@@ -0,0 +1,106 @@
+"""
+Benchmark of the waiting task lookup on a seeded copy of avt_task.
+
+Creates the table avt_task_benchmark with the columns of avt_task, fills it with `--rows` tasks of which
+`--waiting_ratio` are waiting, and measures the latency of:
+- the previous query: ORDER BY abs(task_stat + 1), created_at DESC, without index
+- the current query: ORDER BY task_stat DESC, created_at DESC, with the partial index of
+  migrations/001_avt_task_waiting_index.sql
+The benchmark table is dropped at the end.
+
+Usage:
+    python benchmarks/waiting_task_query.py --config_file config.json [--rows 1000000]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import Database, DatabaseConfig
+
+TABLE = "avt_task_benchmark"
+
+OLD_QUERY = f"""
+    SELECT * FROM {TABLE}
+    WHERE task_stat < 0 AND task_type = :task_type
+    ORDER BY abs(task_stat - (-1)), created_at DESC
+    LIMIT 1
+"""
+
+NEW_QUERY = f"""
+    SELECT * FROM {TABLE}
+    WHERE task_stat < 0 AND task_type = :task_type
+    ORDER BY task_stat DESC, created_at DESC
+    LIMIT 1
+"""
+
+def seed(connection, rows, waiting_ratio, task_types):
+    connection.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+    connection.execute(text(f"CREATE TABLE {TABLE} (LIKE avt_task INCLUDING DEFAULTS)"))
+    # Finished (1) and failed (0) tasks with a few waiting ones (-1 to -5), spread over a year
+    connection.execute(text(f"""
+        INSERT INTO {TABLE} (id, task_type, creator, task_param, task_stat, created_at, updated_at)
+        SELECT i, 1 + (i % :task_types), 'benchmark', '{{}}',
+               CASE WHEN random() < :waiting_ratio THEN -1 - (i % 5) ELSE (i % 2) END,
+               now() - (random() * interval '365 days'), now()
+        FROM generate_series(1, :rows) AS i
+    """), {"rows": rows, "waiting_ratio": waiting_ratio, "task_types": task_types})
+    connection.execute(text(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id)"))
+    connection.execute(text(f"ANALYZE {TABLE}"))
+
+def measure(connection, query, task_type, repeat):
+    latencies = []
+    first_id = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        row = connection.execute(text(query), {"task_type": task_type}).first()
+        latencies.append((time.perf_counter() - start) * 1000)
+        first_id = row.id if row is not None else None
+    plan = connection.execute(text("EXPLAIN " + query), {"task_type": task_type}).scalars().all()
+    return statistics.median(latencies), min(latencies), first_id, plan
+
+def report(name, result):
+    median, best, first_id, plan = result
+    print(f"{name}: median {median:.2f} ms, min {best:.2f} ms, first task {first_id}")
+    for line in plan:
+        print(f"    {line}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of the waiting task query')
+    parser.add_argument('--config_file', type=str, default='config.json', help='Config file with the database settings')
+    parser.add_argument('--rows', type=int, default=1000000, help='Number of seeded tasks')
+    parser.add_argument('--waiting_ratio', type=float, default=0.01, help='Fraction of waiting tasks')
+    parser.add_argument('--task_types', type=int, default=10, help='Number of task types')
+    parser.add_argument('--repeat', type=int, default=50, help='Number of timed queries per case')
+    args = parser.parse_args()
+
+    db = Database.from_config(DatabaseConfig.read_from_json(args.config_file))
+    if not db.connected:
+        sys.exit(1)
+
+    with db.engine.connect() as connection:
+        print(f"Seeding {args.rows} tasks...")
+        seed(connection, args.rows, args.waiting_ratio, args.task_types)
+        connection.commit()
+        try:
+            task_type = 7 % args.task_types + 1
+            old_result = measure(connection, OLD_QUERY, task_type, args.repeat)
+            report("Previous query, no index", old_result)
+            report("Current query, no index", measure(connection, NEW_QUERY, task_type, args.repeat))
+
+            connection.execute(text(f"CREATE INDEX ON {TABLE} (task_type, task_stat DESC, created_at DESC) WHERE task_stat < 0"))
+            connection.execute(text(f"ANALYZE {TABLE}"))
+            connection.commit()
+            new_result = measure(connection, NEW_QUERY, task_type, args.repeat)
+            report("Current query, partial index", new_result)
+            if old_result[2] != new_result[2]:
+                print("WARNING: the queries returned different tasks")
+            print(f"Speedup: {old_result[0] / new_result[0]:.1f}x")
+        finally:
+            connection.rollback()
+            connection.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+            connection.commit()
@@ -1,17 +1,56 @@
-from sqlalchemy import create_engine, Column, Integer, Text, Float, Boolean, exc, text, DateTime, VARCHAR
+from sqlalchemy import create_engine, Column, Integer, Text, Float, Boolean, exc, text, DateTime, VARCHAR, Index
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy import and_, func
+from sqlalchemy import and_, select, update, insert, values, column, cast
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
-import json, os
+import json, os, socket, time
+import select as io_select
+
+# task_stat values: < 0 waiting, 0 error, 1 finished, > 1 running (elapsed seconds)
+TASK_STAT_CLAIMED = 2
+
+# Maximum number of rows sent in one statement by the bulk operations
+BULK_CHUNK_SIZE = 1000
+
+# Prefix of the NOTIFY channels carrying the ids of new waiting tasks, one channel per task type
+TASK_NOTIFY_CHANNEL_PREFIX = "avt_task_waiting_"
+
+# Trigger sending NOTIFY avt_task_waiting_<task_type> with the task id when a task is inserted as
+# waiting, or put back to waiting by an update
+TASK_NOTIFY_TRIGGER_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION avt_task_notify_waiting() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.task_stat < 0 AND (TG_OP = 'INSERT' OR OLD.task_stat IS NULL OR OLD.task_stat >= 0) THEN
+            PERFORM pg_notify('avt_task_waiting_' || NEW.task_type, NEW.id::text);
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS avt_task_notify_waiting ON avt_task",
+    """
+    CREATE TRIGGER avt_task_notify_waiting
+    AFTER INSERT OR UPDATE OF task_stat ON avt_task
+    FOR EACH ROW EXECUTE FUNCTION avt_task_notify_waiting()
+    """,
+]
 
 class DatabaseConfig:
-    def __init__(self, host="localhost", database="avt", user="postgres", password="123456", port=5432):
+    def __init__(self, host="localhost", database="avt", user="postgres", password="123456", port=5432,
+                 pool_size=5, max_overflow=10, pool_pre_ping=True, statement_timeout=0,
+                 heartbeat_interval=1.0, heartbeat_jitter=0.2):
         self.host = host
         self.database = database
         self.user = user
         self.password = password
         self.port = port
+        self.pool_size = pool_size # connections kept open in the engine pool
+        self.max_overflow = max_overflow # extra connections opened when the pool is exhausted
+        self.pool_pre_ping = pool_pre_ping # check connections before use, drops connections closed by the server
+        self.statement_timeout = statement_timeout # milliseconds, 0 disables the timeout
+        self.heartbeat_interval = heartbeat_interval # seconds between running time updates of a task
+        self.heartbeat_jitter = heartbeat_jitter # random variation of the interval, as a fraction of it
         
     def save_to_json(self, file_path='config.json'):
         if not os.path.exists(file_path):
@@ -25,7 +64,13 @@ class DatabaseConfig:
             'database': self.database,
             'user': self.user,
             'password': self.password,
-            'port': self.port
+            'port': self.port,
+            'pool_size': self.pool_size,
+            'max_overflow': self.max_overflow,
+            'pool_pre_ping': self.pool_pre_ping,
+            'statement_timeout': self.statement_timeout,
+            'heartbeat_interval': self.heartbeat_interval,
+            'heartbeat_jitter': self.heartbeat_jitter
         }
         
         with open(file_path, 'w') as json_file:
@@ -63,6 +108,22 @@ class AvtTask(Base):
     updated_at = Column(DateTime, nullable=True)
     user_id = Column(Integer, nullable=True)
 
+    __table_args__ = (
+        # Waiting queue lookup: only waiting rows are indexed, in the order of waiting_task_order().
+        # Created on existing databases by migrations/001_avt_task_waiting_index.sql
+        Index('ix_avt_task_waiting', 'task_type', task_stat.desc(), created_at.desc(),
+              postgresql_where=task_stat < 0),
+    )
+
+def waiting_task_order():
+    """
+    Order of waiting tasks: task_stat closest to -1 first, then the latest created.
+
+    For waiting tasks (task_stat < 0), abs(task_stat + 1) ascending is task_stat descending, which
+    unlike the expression can be read from the ix_avt_task_waiting index without sorting.
+    """
+    return (AvtTask.task_stat.desc(), AvtTask.created_at.desc())
+
 class TaskConfig(Base):
     __tablename__ = 'avt_task_config'
     
@@ -79,11 +140,85 @@ class TaskConfig(Base):
     created_at = Column(DateTime, nullable=False)
     updated_at = Column(DateTime, nullable=True)
 
+class TaskListener:
+    """
+    Waits for NOTIFY messages of new waiting tasks of one type on a dedicated connection, outside
+    of the engine pool. The messages are only sent by the trigger of Database.install_task_notify_trigger.
+
+    LISTEN is issued on creation, so tasks inserted after that are notified even when the listener
+    is not waiting at that moment. After a connection error, the listener reconnects on the next wait.
+    """
+    def __init__(self, engine, task_type):
+        self.engine = engine
+        self.channel = f"{TASK_NOTIFY_CHANNEL_PREFIX}{int(task_type)}"
+        self._connection = None
+        self._connect()
+
+    def _connect(self):
+        try:
+            pool_connection = self.engine.raw_connection()
+            connection = pool_connection.driver_connection
+            # The connection stays in LISTEN state, it must never go back to the pool
+            pool_connection.detach()
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            self._connection = connection
+        except Exception as e:
+            print(f"Cannot listen for tasks on channel '{self.channel}': {e}")
+            self._connection = None
+        return self._connection is not None
+
+    # Longest uninterrupted wait, so a stop request is noticed quickly
+    WAKE_UP_INTERVAL = 1.0
+
+    def wait(self, timeout, stop_event=None):
+        """
+        Wait for notifications of new waiting tasks.
+
+        :param timeout: Maximum number of seconds to wait.
+        :param stop_event: Optional threading.Event ending the wait early when set.
+        :return: List of the notified task ids, empty on timeout or stop, or None when the listener has
+                 no connection (the caller then falls back to polling).
+        """
+        deadline = time.time() + timeout
+        if self._connection is None and not self._connect():
+            return None
+        try:
+            while not self._connection.notifies:
+                remaining = deadline - time.time()
+                if remaining <= 0 or (stop_event is not None and stop_event.is_set()):
+                    return []
+                readable, _, _ = io_select.select([self._connection], [], [], min(remaining, self.WAKE_UP_INTERVAL))
+                if readable:
+                    self._connection.poll()
+            task_ids = [int(notify.payload) for notify in self._connection.notifies if notify.payload.isdigit()]
+            self._connection.notifies.clear()
+            return task_ids
+        except Exception as e:
+            print(f"Listening for tasks on channel '{self.channel}' failed: {e}")
+            self.close()
+            return None
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
 class Database:
-    def __init__(self, host, port, user, password, db_name):
+    def __init__(self, host, port, user, password, db_name, pool_size=5, max_overflow=10, pool_pre_ping=True, statement_timeout=0):
         self.db_url = self.create_db_url(host, port, user, password, db_name)
-        self.engine = create_engine(self.db_url)
+        connect_args = {}
+        if statement_timeout:
+            # Applied by the server to every statement of every connection of the pool
+            connect_args['options'] = f"-c statement_timeout={int(statement_timeout)}"
+        self.engine = create_engine(self.db_url, pool_size=pool_size, max_overflow=max_overflow,
+                                    pool_pre_ping=pool_pre_ping, connect_args=connect_args)
         self.Session = sessionmaker(bind=self.engine)
+        self._task_listeners = {}
         self.connected = False
         try:
             self.test_connection()
@@ -91,6 +226,12 @@ class Database:
         except Exception as e:
             print(f"Failed to connect to the database: {e}")
 
+    @classmethod
+    def from_config(cls, db_config: DatabaseConfig):
+        return cls(db_config.host, db_config.port, db_config.user, db_config.password, db_config.database,
+                   pool_size=db_config.pool_size, max_overflow=db_config.max_overflow,
+                   pool_pre_ping=db_config.pool_pre_ping, statement_timeout=db_config.statement_timeout)
+
     @staticmethod
     def create_db_url(host, port, user, password, db_name):
         return f'postgresql://{user}:{password}@{host}:{port}/{db_name}'
@@ -127,18 +268,54 @@ class Database:
         
         return task_id
 
+    def add_tasks(self, tasks):
+        """
+        Insert many tasks in one statement per BULK_CHUNK_SIZE tasks.
+
+        :param tasks: List of dicts with the arguments of add_task (task_type and creator are required).
+        :return: List of the new task ids in the order of `tasks`, or None on error.
+        """
+        if not tasks:
+            return []
+        now = datetime.now()
+        rows = []
+        for task in tasks:
+            row = dict(task)
+            task_param = row.get('task_param')
+            if isinstance(task_param, (list, dict)):
+                row['task_param'] = json.dumps(task_param)
+            row.setdefault('created_at', now)
+            row.setdefault('updated_at', now)
+            rows.append(row)
+        # Every row must bind the same columns
+        columns = set().union(*rows)
+        rows = [{name: row.get(name) for name in columns} for row in rows]
+
+        session = self.Session()
+        try:
+            task_ids = []
+            insert_query = insert(AvtTask).returning(AvtTask.id, sort_by_parameter_order=True)
+            for start in range(0, len(rows), BULK_CHUNK_SIZE):
+                result = session.execute(insert_query, rows[start:start + BULK_CHUNK_SIZE])
+                task_ids.extend(result.scalars().all())
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            print(f"Error adding tasks: {e}")
+            task_ids = None
+        finally:
+            session.close()
+
+        return task_ids
+
     def update_task(self, task_id, **kwargs):
         session = self.Session()
         
         try:
-            task = session.query(AvtTask).filter_by(id=task_id).first()
-            if not task:
-                return False
-            for key, value in kwargs.items():
-                setattr(task, key, value)
-            task.updated_at = datetime.now()
+            # Single UPDATE without reading the row first
+            result = session.execute(update(AvtTask).where(AvtTask.id == task_id).values(updated_at=datetime.now(), **kwargs))
             session.commit()
-            success = True
+            success = result.rowcount > 0
         except SQLAlchemyError as e:
             session.rollback()
             print(f"Error updating task: {e}")
@@ -148,6 +325,45 @@ class Database:
         
         return success
 
+    def update_tasks(self, updates):
+        """
+        Update many tasks with different values in one UPDATE ... FROM (VALUES ...) statement per set of
+        updated columns and BULK_CHUNK_SIZE tasks. updated_at is set on every updated task.
+
+        :param updates: Dict mapping task id to a dict of column values, e.g. {5: {'task_stat': 1, 'task_output': '...'}}.
+        :return: Number of updated tasks, or None on error.
+        """
+        # Tasks updating the same columns share a statement
+        groups = {}
+        for task_id, task_values in updates.items():
+            groups.setdefault(tuple(sorted(task_values)), []).append((task_id, task_values))
+
+        now = datetime.now()
+        session = self.Session()
+        try:
+            updated = 0
+            for names, group in groups.items():
+                table_columns = [AvtTask.__table__.c[name] for name in names]
+                for start in range(0, len(group), BULK_CHUNK_SIZE):
+                    chunk = group[start:start + BULK_CHUNK_SIZE]
+                    rows = values(column('id', Integer), *[column(c.name, c.type) for c in table_columns], name='new_values').data(
+                        [(task_id, *[task_values[name] for name in names]) for task_id, task_values in chunk])
+                    # Cast the values, the type of a VALUES column with only NULLs is unknown to the server
+                    update_query = update(AvtTask).where(AvtTask.id == rows.c.id).values(
+                        updated_at=now,
+                        **{c.name: cast(rows.c[c.name], c.type) for c in table_columns}
+                    ).execution_options(synchronize_session=False)
+                    updated += session.execute(update_query).rowcount
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            print(f"Error updating tasks: {e}")
+            updated = None
+        finally:
+            session.close()
+
+        return updated
+
     def get_waiting_task_by_type(self, task_type):
         session = self.Session()
         try:
@@ -158,10 +374,8 @@ class Database:
                     AvtTask.task_type == task_type
                 )
             ).order_by(
-                # Order by task_stat (closer to -1 is better)
-                func.abs(AvtTask.task_stat - (-1)),
-                # Then order by latest created_at
-                AvtTask.created_at.desc()
+                # Order by task_stat (closer to -1 is better), then by latest created_at
+                *waiting_task_order()
             )
 
             # Fetch the first result
@@ -178,6 +392,71 @@ class Database:
         finally:
             session.close()
 
+    def claim_waiting_tasks(self, task_type, limit=1, worker_ip=None, process_id=None):
+        """
+        Atomically select up to `limit` waiting tasks of a type and mark them as claimed by this worker.
+
+        The selection and the update run as a single UPDATE statement using FOR UPDATE SKIP LOCKED, so
+        concurrent workers never claim the same task and never wait on rows locked by each other.
+
+        :param task_type: Type of the tasks to claim.
+        :param limit: Maximum number of tasks to claim.
+        :param worker_ip: IP written to the claimed tasks, defaults to the IP of this host.
+        :param process_id: Process id written to the claimed tasks, defaults to the current process id.
+        :return: List of claimed tasks in the same order as get_waiting_task_by_type, empty if none.
+        """
+        if worker_ip is None:
+            try:
+                worker_ip = socket.gethostbyname(socket.gethostname())
+            except OSError:
+                worker_ip = None
+        if process_id is None:
+            process_id = os.getpid()
+
+        # Keep the claimed tasks readable after commit and close
+        session = self.Session(expire_on_commit=False)
+        try:
+            waiting = select(AvtTask.id, AvtTask.task_stat.label('waiting_stat')).where(
+                and_(
+                    AvtTask.task_stat < 0,
+                    AvtTask.task_type == task_type
+                )
+            ).order_by(
+                *waiting_task_order()
+            ).limit(limit).with_for_update(skip_locked=True).cte('waiting')
+
+            # Return the task_stat before the claim as well to keep the waiting order
+            claim_query = update(AvtTask).where(AvtTask.id == waiting.c.id).values(
+                task_stat=TASK_STAT_CLAIMED,
+                worker_ip=worker_ip,
+                process_id=process_id,
+                updated_at=datetime.now()
+            ).returning(AvtTask, waiting.c.waiting_stat).execution_options(synchronize_session=False)
+
+            claimed = session.execute(claim_query).all()
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            print(f"Error claiming tasks: {e}")
+            return []
+        finally:
+            session.close()
+
+        claimed.sort(key=lambda row: (-row.waiting_stat, -row.AvtTask.created_at.timestamp()))
+        return [row.AvtTask for row in claimed]
+
+    def claim_waiting_task(self, task_type, worker_ip=None, process_id=None):
+        """
+        Atomically claim the next waiting task of a type, see claim_waiting_tasks.
+
+        :return: The claimed task, or None if there is no waiting task.
+        """
+        tasks = self.claim_waiting_tasks(task_type, limit=1, worker_ip=worker_ip, process_id=process_id)
+        if not tasks:
+            print(f"No tasks found for type {task_type} with task_stat < 0.")
+            return None
+        return tasks[0]
+
     def get_task_by_id(self, task_id):
         session = self.Session()
         try:
@@ -192,6 +471,27 @@ class Database:
         finally:
             session.close()
     
+    def get_tasks_by_ids(self, task_ids):
+        """
+        Fetch many tasks in one query.
+
+        :param task_ids: List of task ids.
+        :return: List of the found tasks in the order of `task_ids`, unknown ids are skipped.
+        """
+        if not task_ids:
+            return []
+        session = self.Session()
+        try:
+            tasks = session.scalars(select(AvtTask).where(AvtTask.id.in_(list(task_ids)))).all()
+        except SQLAlchemyError as e:
+            print(f"Error retrieving tasks by ID: {e}")
+            tasks = []
+        finally:
+            session.close()
+
+        tasks_by_id = {task.id: task for task in tasks}
+        return [tasks_by_id[task_id] for task_id in task_ids if task_id in tasks_by_id]
+
     def get_tasks(self, limit=None, offset=None):
         session = self.Session()
         
@@ -281,6 +581,74 @@ class Database:
         
         return configs
     
+    def install_task_notify_trigger(self):
+        """
+        Create the trigger sending a NOTIFY on the channel of its task type when a waiting task is added.
+
+        :return: True if the trigger was created, otherwise False.
+        """
+        try:
+            with self.engine.begin() as connection:
+                for statement in TASK_NOTIFY_TRIGGER_DDL:
+                    connection.execute(text(statement))
+        except SQLAlchemyError as e:
+            print(f"Error creating the task notify trigger: {e}")
+            return False
+        print("Task notify trigger created")
+        return True
+
+    def listen_for_tasks(self, task_type):
+        """
+        Start listening for new waiting tasks of a type, see TaskListener. The listener is shared by
+        the callers of the same Database object.
+
+        :param task_type: Type of the tasks.
+        :return: TaskListener object.
+        """
+        listener = self._task_listeners.get(task_type)
+        if listener is None:
+            listener = TaskListener(self.engine, task_type)
+            self._task_listeners[task_type] = listener
+        return listener
+
+    def wait_for_waiting_task(self, task_type, stop_event, poll_interval=2.0, max_poll_interval=30.0):
+        """
+        Block until a waiting task of a type is claimed or `stop_event` is set.
+
+        The worker sleeps on LISTEN and claims a task as soon as a NOTIFY arrives from the trigger of
+        install_task_notify_trigger. The table is still polled after `poll_interval` seconds without
+        notification, doubling up to `max_poll_interval` while nothing is found, so tasks are picked up
+        when a notification is missed, the trigger is not installed or the listener is disconnected.
+
+        :param task_type: Type of the task to claim.
+        :param stop_event: threading.Event ending the wait when set.
+        :param poll_interval: Seconds before the first poll without notification.
+        :param max_poll_interval: Maximum seconds between polls without notification.
+        :return: The claimed task, or None if stop_event was set.
+        """
+        # Listen before the first claim, so no task inserted after the claim is missed
+        listener = self.listen_for_tasks(task_type)
+        idle_wait = poll_interval
+        while not stop_event.is_set():
+            task = self.claim_waiting_task(task_type)
+            if task is not None:
+                return task
+
+            task_ids = listener.wait(idle_wait, stop_event)
+            if task_ids is None:
+                # No notifications, plain polling
+                stop_event.wait(idle_wait)
+            if task_ids:
+                idle_wait = poll_interval
+            else:
+                idle_wait = min(idle_wait * 2, max_poll_interval)
+        return None
+
+    def close_listeners(self):
+        for listener in self._task_listeners.values():
+            listener.close()
+        self._task_listeners = {}
+
     def test_connection(self):
         try:
             with self.engine.connect() as connection:
@@ -293,7 +661,7 @@ if __name__ == "__main__":
 
     db_config = DatabaseConfig().read_from_json("config.json")
     print(db_config.host, db_config.port)
-    db = Database(db_config.host, db_config.port, db_config.user, db_config.password, db_config.database)
+    db = Database.from_config(db_config)
     task = db.get_waiting_task_by_type(1)
     if task is not None:
         print("Task: ", task.id)
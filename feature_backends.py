@@ -0,0 +1,125 @@
+import cv2
+import numpy as np
+
+# FLANN index algorithms, see cv2.flann
+FLANN_INDEX_KDTREE = 1
+FLANN_INDEX_LSH = 6
+
+MATCHERS = ("flann", "bruteforce")
+
+
+class FeatureBackend():
+    """
+    Feature detector and descriptor matcher settings used by the template matching.
+
+    Float descriptors (SIFT) are matched with a FLANN KD-tree index on the L2 distance. Binary descriptors
+    (ORB, AKAZE, BRISK) are matched with a FLANN LSH index or brute force, both on the Hamming distance.
+    """
+    def __init__(self, name, create_detector, binary, descriptor_size, matcher="flann", lsh_table_number=6,
+                 lsh_key_size=12, lsh_multi_probe_level=1):
+        """
+        :param name: Name of the backend, part of the feature cache keys.
+        :param create_detector: Function without arguments returning a new cv2.Feature2D.
+        :param binary: True for binary descriptors matched on the Hamming distance, False for float descriptors.
+        :param descriptor_size: Number of descriptor columns (floats or bytes).
+        :param matcher: "flann" (KD-tree or LSH index) or "bruteforce".
+        :param lsh_table_number: Number of hash tables of the LSH index.
+        :param lsh_key_size: Hash key size in bits of the LSH index.
+        :param lsh_multi_probe_level: Number of neighbouring buckets searched by the LSH index.
+        """
+        self.name = name
+        self.create_detector = create_detector
+        self.binary = binary
+        self.descriptor_size = descriptor_size
+        self.matcher = matcher
+        self.lsh_table_number = lsh_table_number
+        self.lsh_key_size = lsh_key_size
+        self.lsh_multi_probe_level = lsh_multi_probe_level
+
+    @property
+    def descriptor_dtype(self):
+        return np.uint8 if self.binary else np.float32
+
+    @property
+    def norm_type(self):
+        return cv2.NORM_HAMMING if self.binary else cv2.NORM_L2
+
+    @property
+    def squared_distances(self):
+        # The FLANN KD-tree returns squared L2 distances, Hamming distances and brute force L2 distances are not squared
+        return not self.binary and self.matcher == "flann"
+
+    @property
+    def index_cacheable(self):
+        # FLANN does not serialize the hash tables of an LSH index, a loaded LSH index crashes on search.
+        # LSH indexes are quick to build, so only KD-tree indexes are stored in the feature cache
+        return not self.binary
+
+    def empty_descriptors(self):
+        return np.empty((0, self.descriptor_size), dtype=self.descriptor_dtype)
+
+    def index_params(self, flann_index_algorithm=FLANN_INDEX_KDTREE, flann_trees=5):
+        """
+        FLANN index parameters. flann_index_algorithm and flann_trees only apply to float descriptors,
+        binary descriptors always use an LSH index.
+        """
+        if self.binary:
+            return dict(algorithm=FLANN_INDEX_LSH, table_number=self.lsh_table_number,
+                        key_size=self.lsh_key_size, multi_probe_level=self.lsh_multi_probe_level)
+        return dict(algorithm=flann_index_algorithm, trees=flann_trees)
+
+    def index_key(self, flann_index_algorithm=FLANN_INDEX_KDTREE, flann_trees=5, flann_search_checks=50):
+        """
+        Name of the FLANN index settings, used as cache key of a trained index.
+        """
+        if self.binary:
+            return f"lsh_t{self.lsh_table_number}_k{self.lsh_key_size}_p{self.lsh_multi_probe_level}_c{flann_search_checks}"
+        return f"a{flann_index_algorithm}_t{flann_trees}_c{flann_search_checks}"
+
+
+def _create_sift():
+    return cv2.SIFT_create()
+
+def _create_orb():
+    # The default of 500 features is too few for a main image
+    return cv2.ORB_create(nfeatures=20000)
+
+def _create_akaze():
+    return cv2.AKAZE_create()
+
+def _create_brisk():
+    return cv2.BRISK_create()
+
+# name: (detector factory, binary descriptors, descriptor size, name of the cv2 factory)
+_BACKENDS = {
+    "sift": (_create_sift, False, 128, "SIFT_create"),
+    "orb": (_create_orb, True, 32, "ORB_create"),
+    "akaze": (_create_akaze, True, 61, "AKAZE_create"),
+    "brisk": (_create_brisk, True, 64, "BRISK_create"),
+}
+
+DEFAULT_FEATURE_BACKEND = "sift"
+
+
+def get_feature_backend(name=DEFAULT_FEATURE_BACKEND, matcher=None):
+    """
+    Get a feature backend by name.
+
+    :param name: "sift" (default), "orb", "akaze" or "brisk", or a FeatureBackend returned as is.
+    :param matcher: "flann" or "bruteforce", defaults to "flann".
+    :return: FeatureBackend, or None if the backend or the matcher is unknown or not available in the installed OpenCV.
+    """
+    if isinstance(name, FeatureBackend):
+        return name
+    if name not in _BACKENDS:
+        print(f"Unknown feature backend '{name}', expected one of {tuple(_BACKENDS)}.")
+        return None
+    matcher = matcher or "flann"
+    if matcher not in MATCHERS:
+        print(f"Unknown matcher '{matcher}', expected one of {MATCHERS}.")
+        return None
+    create_detector, binary, descriptor_size, factory_name = _BACKENDS[name]
+    if not hasattr(cv2, factory_name):
+        print(f"Feature backend '{name}' is not available in OpenCV {cv2.__version__}.")
+        return None
+    return FeatureBackend(name, create_detector, binary, descriptor_size, matcher=matcher)
@@ -0,0 +1,272 @@
+import cv2
+import numpy as np
+import os, json, shutil, time, uuid
+from file_cache import FileLock
+
+# Structured layout used to store cv2.KeyPoint attributes on disk
+KEYPOINT_DTYPE = np.dtype([
+    ('x', np.float32),
+    ('y', np.float32),
+    ('size', np.float32),
+    ('angle', np.float32),
+    ('response', np.float32),
+    ('octave', np.int32),
+    ('class_id', np.int32),
+])
+
+DEFAULT_FEATURE_CACHE_SIZE = 8 * 1024 ** 3 # 8 GB
+
+
+def keypoints_to_array(keypoints):
+    """
+    Convert a list of cv2.KeyPoint into a structured NumPy array, filled field by field.
+
+    :param keypoints: List of cv2.KeyPoint.
+    :return: Structured array with KEYPOINT_DTYPE fields.
+    """
+    count = len(keypoints)
+    array = np.empty(count, dtype=KEYPOINT_DTYPE)
+    if count == 0:
+        return array
+    # Positions are converted by OpenCV, the other attributes are streamed without intermediate tuples
+    points = cv2.KeyPoint_convert(keypoints).reshape(-1, 2)
+    array['x'], array['y'] = points[:, 0], points[:, 1]
+    array['size'] = np.fromiter((kp.size for kp in keypoints), dtype=np.float32, count=count)
+    array['angle'] = np.fromiter((kp.angle for kp in keypoints), dtype=np.float32, count=count)
+    array['response'] = np.fromiter((kp.response for kp in keypoints), dtype=np.float32, count=count)
+    array['octave'] = np.fromiter((kp.octave for kp in keypoints), dtype=np.int32, count=count)
+    array['class_id'] = np.fromiter((kp.class_id for kp in keypoints), dtype=np.int32, count=count)
+    return array
+
+
+class FeatureCache():
+    """
+    On-disk store of keypoints and descriptors of main images, keyed by the image MD5 checksum.
+
+    Each entry is a directory holding `keypoints.npy`, `descriptors.npy`, `meta.json` and the trained
+    FLANN indexes (`flann_<settings>.idx`) of the descriptors. The
+    modification time of `meta.json` is used as the last access time for LRU eviction once the
+    total size of the cache exceeds `max_size_bytes`.
+    """
+    INDEX_FILE = "index.json"
+    LOCK_FILE = "index.lock"
+    META_FILE = "meta.json"
+    KEYPOINTS_FILE = "keypoints.npy"
+    DESCRIPTORS_FILE = "descriptors.npy"
+
+    def __init__(self, cache_dir=None, max_size_bytes=DEFAULT_FEATURE_CACHE_SIZE):
+        if cache_dir is None:
+            if os.name == 'nt':  # Windows
+                cache_dir = "C:\\temp\\feature_cache"
+            else:  # Unix-like systems
+                cache_dir = "/tmp/feature_cache"
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @classmethod
+    def read_from_json(cls, file_path='config.json'):
+        if not os.path.exists(file_path):
+            print(f"File {file_path} not found. Returning default settings.")
+            return cls()
+
+        with open(file_path, 'r') as json_file:
+            settings = json.load(json_file)
+
+        cache_settings = settings.get('feature_cache', {})
+        return cls(**cache_settings)
+
+    def _entry_dir(self, checksum, variant):
+        return os.path.join(self.cache_dir, f"{checksum}_{variant}")
+
+    def _read_index(self):
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        if not os.path.exists(index_path):
+            return {}
+        try:
+            with open(index_path, 'r') as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        tmp_path = f"{index_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as index_file:
+            json.dump(index, index_file)
+        os.replace(tmp_path, index_path)
+
+    def _check_image_key(self, checksum, image_key):
+        """
+        Drop the cached features of `image_key` when its checksum has changed since they were stored.
+        The index is read and written under an inter-process file lock, so no update of another worker is lost.
+        """
+        if image_key is None:
+            return
+        with FileLock(os.path.join(self.cache_dir, self.LOCK_FILE)):
+            index = self._read_index()
+            old_checksum = index.get(image_key)
+            if old_checksum == checksum:
+                return
+            if old_checksum is not None:
+                print(f"Checksum of '{image_key}' changed, invalidating cached features.")
+                self.invalidate(old_checksum)
+            index[image_key] = checksum
+            self._write_index(index)
+
+    def load(self, checksum, variant="sift", image_key=None):
+        """
+        Load cached keypoints and descriptors of an image.
+
+        :param checksum: MD5 checksum of the image.
+        :param variant: Name of the feature extraction settings the features were computed with.
+        :param image_key: Optional stable name of the image (e.g. FTP path), used to detect checksum changes.
+        :return: (keypoints array, descriptors) memory-mapped from disk, or (None, None) on cache miss.
+        """
+        if checksum is None:
+            return None, None
+        self._check_image_key(checksum, image_key)
+
+        entry_dir = self._entry_dir(checksum, variant)
+        meta_path = os.path.join(entry_dir, self.META_FILE)
+        if not os.path.exists(meta_path):
+            return None, None
+        try:
+            keypoints = np.load(os.path.join(entry_dir, self.KEYPOINTS_FILE), mmap_mode='r')
+            descriptors = np.load(os.path.join(entry_dir, self.DESCRIPTORS_FILE), mmap_mode='r')
+            # Touch meta file to record the access time for LRU eviction
+            os.utime(meta_path, None)
+        except (OSError, ValueError) as e:
+            print(f"Feature cache: cannot read entry '{entry_dir}': {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None, None
+
+        return keypoints, descriptors
+
+    def save(self, checksum, keypoints, descriptors, variant="sift", image_key=None):
+        """
+        Store keypoints and descriptors of an image.
+
+        :param checksum: MD5 checksum of the image.
+        :param keypoints: List of cv2.KeyPoint or structured keypoint array.
+        :param descriptors: Descriptor matrix.
+        :param variant: Name of the feature extraction settings the features were computed with.
+        :param image_key: Optional stable name of the image (e.g. FTP path), used to detect checksum changes.
+        :return: True if the entry was stored, otherwise False.
+        """
+        if checksum is None or descriptors is None:
+            return False
+        self._check_image_key(checksum, image_key)
+
+        if not isinstance(keypoints, np.ndarray):
+            keypoints = keypoints_to_array(keypoints)
+
+        entry_dir = self._entry_dir(checksum, variant)
+        if os.path.exists(entry_dir):
+            return True
+
+        # Write into a temporary directory first so that concurrent readers never see a partial entry
+        tmp_dir = f"{entry_dir}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(tmp_dir)
+            np.save(os.path.join(tmp_dir, self.KEYPOINTS_FILE), keypoints)
+            np.save(os.path.join(tmp_dir, self.DESCRIPTORS_FILE), descriptors)
+            with open(os.path.join(tmp_dir, self.META_FILE), 'w') as meta_file:
+                json.dump({
+                    'checksum': checksum,
+                    'variant': variant,
+                    'image_key': image_key,
+                    'num_keypoints': int(len(keypoints)),
+                    'created_at': time.time()
+                }, meta_file)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another worker may have stored the same entry in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return os.path.exists(entry_dir)
+
+        self._evict()
+        return True
+
+    def load_flann_index(self, checksum, descriptors, index_key, variant="sift"):
+        """
+        Load a FLANN index trained on the cached descriptors of an image.
+
+        :param checksum: MD5 checksum of the image.
+        :param descriptors: The cached descriptors the index was built on. They must stay alive while the index is used.
+        :param index_key: Name of the index settings (algorithm, trees, checks).
+        :param variant: Name of the feature extraction settings the features were computed with.
+        :return: cv2.flann_Index, or None on cache miss.
+        """
+        index_path = os.path.join(self._entry_dir(checksum, variant), f"flann_{index_key}.idx")
+        if not os.path.exists(index_path):
+            return None
+        index = cv2.flann_Index()
+        if not index.load(descriptors, index_path):
+            print(f"Feature cache: cannot load FLANN index '{index_path}'")
+            return None
+        return index
+
+    def save_flann_index(self, checksum, index, index_key, variant="sift"):
+        """
+        Store a FLANN index next to the cached descriptors of an image.
+
+        :param checksum: MD5 checksum of the image.
+        :param index: cv2.flann_Index built on the cached descriptors.
+        :param index_key: Name of the index settings (algorithm, trees, checks).
+        :param variant: Name of the feature extraction settings the features were computed with.
+        :return: True if the index was stored, otherwise False.
+        """
+        entry_dir = self._entry_dir(checksum, variant)
+        if not os.path.exists(entry_dir):
+            return False
+        index_path = os.path.join(entry_dir, f"flann_{index_key}.idx")
+        tmp_path = f"{index_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            index.save(tmp_path)
+            os.replace(tmp_path, index_path)
+        except (OSError, cv2.error) as e:
+            print(f"Feature cache: cannot save FLANN index '{index_path}': {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+        self._evict()
+        return True
+
+    def invalidate(self, checksum):
+        """
+        Remove all cached entries of a checksum.
+
+        :param checksum: MD5 checksum of the image.
+        """
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(f"{checksum}_"):
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+    def _evict(self):
+        """
+        Remove least recently used entries until the cache fits into `max_size_bytes`.
+        """
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(entry_dir, self.META_FILE)
+            if name.endswith('.tmp') or not os.path.exists(meta_path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+                last_access = os.path.getmtime(meta_path)
+            except OSError:
+                continue
+            entries.append((last_access, size, entry_dir))
+            total_size += size
+
+        entries.sort()
+        for last_access, size, entry_dir in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            print(f"Feature cache: evicting '{entry_dir}'")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
@@ -0,0 +1,240 @@
+import os, json, time, uuid
+
+if os.name == 'nt':  # Windows
+    import msvcrt
+else:  # Unix-like systems
+    import fcntl
+
+DEFAULT_FILE_CACHE_SIZE = 50 * 1024 ** 3 # 50 GB
+DEFAULT_PARTIAL_MAX_AGE = 24 * 3600 # seconds without a write after which a partial download can be evicted
+
+
+class FileLock():
+    """
+    Inter-process exclusive lock on a lock file, used as a context manager.
+
+    With remove=True the lock file is removed when the lock is released. On Unix the file is removed while
+    the lock is held, so a process that locked the removed file tries again on a new one. On Windows an
+    opened file cannot be removed, so it is only removed when no other process waits for the lock.
+    """
+    def __init__(self, lock_path, remove=False):
+        self.lock_path = lock_path
+        self.remove = remove
+        self._file = None
+
+    def __enter__(self):
+        if os.name == 'nt':
+            self._file = open(self.lock_path, 'a+')
+            self._file.seek(0)
+            # LK_LOCK retries for 10 seconds, keep trying until the lock is acquired
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            while True:
+                self._file = open(self.lock_path, 'a+')
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                if not self.remove or self._is_current_file():
+                    break
+                # The previous holder removed the file, this lock excludes nobody
+                self._file.close()
+        return self
+
+    def _is_current_file(self):
+        try:
+            return os.path.samestat(os.fstat(self._file.fileno()), os.stat(self.lock_path))
+        except FileNotFoundError:
+            return False
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if os.name == 'nt':
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            if self.remove:
+                os.remove(self.lock_path)
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+        if self.remove and os.name == 'nt':
+            try:
+                os.remove(self.lock_path)
+            except OSError:
+                # Opened by a process waiting for the lock, which removes it in turn
+                pass
+
+
+class LocalFileCache():
+    """
+    Content-addressed store of downloaded files, keyed by their MD5 checksum.
+
+    A small JSON index keeps the size and last access time of every file, so a cache hit needs no
+    rehash of the file. Least recently used files are evicted when the total size exceeds
+    `max_size_bytes`. The index is only read and written under an inter-process file lock, so several
+    worker processes can share one cache directory.
+
+    Partial files of interrupted downloads in incoming/ count toward `max_size_bytes` as well. They are
+    kept to be resumed, and evicted with the least recently used files once they were not written for
+    `partial_max_age` seconds.
+    """
+    INDEX_FILE = "index.json"
+    LOCK_FILE = "index.lock"
+
+    def __init__(self, cache_dir=None, max_size_bytes=DEFAULT_FILE_CACHE_SIZE, partial_max_age=DEFAULT_PARTIAL_MAX_AGE):
+        if cache_dir is None:
+            if os.name == 'nt':  # Windows
+                cache_dir = "C:\\temp\\file_cache"
+            else:  # Unix-like systems
+                cache_dir = "/tmp/file_cache"
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.partial_max_age = partial_max_age
+        os.makedirs(os.path.join(self.cache_dir, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.cache_dir, "incoming"), exist_ok=True)
+
+    @classmethod
+    def read_from_json(cls, file_path='config.json'):
+        if not os.path.exists(file_path):
+            print(f"File {file_path} not found. Returning default settings.")
+            return cls()
+
+        with open(file_path, 'r') as json_file:
+            settings = json.load(json_file)
+
+        cache_settings = settings.get('file_cache', {})
+        return cls(**cache_settings)
+
+    def _lock(self):
+        return FileLock(os.path.join(self.cache_dir, self.LOCK_FILE))
+
+    def _read_index(self):
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        if not os.path.exists(index_path):
+            return {}
+        try:
+            with open(index_path, 'r') as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        tmp_path = f"{index_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as index_file:
+            json.dump(index, index_file)
+        os.replace(tmp_path, index_path)
+
+    def _object_path(self, checksum, extension):
+        return os.path.join(self.cache_dir, "objects", checksum[:2], checksum + extension)
+
+    def get(self, checksum):
+        """
+        Get the path of a cached file and mark it as recently used.
+
+        :param checksum: MD5 checksum of the file.
+        :return: Path of the cached file, or None on cache miss.
+        """
+        if checksum is None:
+            return None
+        with self._lock():
+            index = self._read_index()
+            entry = index.get(checksum)
+            if entry is None:
+                return None
+            path = os.path.join(self.cache_dir, entry['path'])
+            if not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+                # Removed or truncated outside of the cache
+                del index[checksum]
+                self._write_index(index)
+                return None
+            entry['last_access'] = time.time()
+            self._write_index(index)
+        return path
+
+    def incoming_path(self, filename, checksum=None):
+        """
+        Get a temporary path inside the cache directory to download a file into, so that put() can move
+        it in place without copying.
+
+        :param filename: Name of the file, its extension is kept.
+        :param checksum: MD5 checksum of the file. The path is stable for a checksum so an interrupted
+                         download can be resumed, and unique when None.
+        :return: Temporary file path.
+        """
+        prefix = checksum if checksum is not None else uuid.uuid4().hex
+        return os.path.join(self.cache_dir, "incoming", f"{prefix}_{filename}")
+
+    def put(self, checksum, file_path):
+        """
+        Move a file into the cache and evict least recently used files if the cache is over budget.
+
+        :param checksum: MD5 checksum of the file.
+        :param file_path: Path of the file to move into the cache, preferably from incoming_path().
+        :return: Path of the cached file.
+        """
+        extension = os.path.splitext(file_path)[1]
+        path = self._object_path(checksum, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock():
+            os.replace(file_path, path)
+            index = self._read_index()
+            index[checksum] = {
+                'path': os.path.relpath(path, self.cache_dir),
+                'size': os.path.getsize(path),
+                'last_access': time.time()
+            }
+            self._evict(index, keep=checksum)
+            self._write_index(index)
+        return path
+
+    def _partial_files(self):
+        """
+        (path, size, last write time) of the partial downloads in incoming/, without their lock files.
+        """
+        partials = []
+        for entry in os.scandir(os.path.join(self.cache_dir, "incoming")):
+            if not entry.is_file() or entry.name.endswith(".lock"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Moved into the cache meanwhile
+                continue
+            partials.append((entry.path, stat.st_size, stat.st_mtime))
+        return partials
+
+    def _evict(self, index, keep=None):
+        """
+        Remove least recently used files from the index and the disk until the cache, with the partial
+        downloads, fits into `max_size_bytes`. Must be called with the lock held.
+        """
+        partials = self._partial_files()
+        total_size = sum(entry['size'] for entry in index.values()) + sum(size for _, size, _ in partials)
+        # Cached files by last access and partial downloads by last write, oldest first
+        candidates = [(entry['last_access'], checksum, os.path.join(self.cache_dir, entry['path']), entry['size'])
+                      for checksum, entry in index.items()]
+        candidates += [(last_write, None, path, size) for path, size, last_write in partials]
+        now = time.time()
+        for last_use, checksum, path, size in sorted(candidates, key=lambda candidate: candidate[0]):
+            if total_size <= self.max_size_bytes:
+                break
+            if checksum is not None and checksum == keep:
+                continue
+            if checksum is None and now - last_use < self.partial_max_age:
+                # The download may still be running or be resumed soon
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # e.g. the file is still opened by another process on Windows
+                print(f"File cache: cannot evict '{os.path.relpath(path, self.cache_dir)}': {e}")
+                continue
+            print(f"File cache: evicted '{os.path.relpath(path, self.cache_dir)}'")
+            total_size -= size
+            if checksum is not None:
+                del index[checksum]
@@ -1,14 +1,27 @@
 import ftplib
 from ftplib import FTP
 from tqdm import tqdm
-import os, json, hashlib
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from file_cache import FileLock
+import os, json, hashlib, threading, time
+
+SEGMENTED_DOWNLOAD_MIN_SIZE = 64 * 1024 ** 2 # smaller files are downloaded over a single connection
+SEGMENT_BLOCK_SIZE = 1024 * 1024
+HASH_BLOCK_SIZE = 1024 * 1024
+CHECKSUM_SIDECAR_SUFFIX = ".checksum.json" # memoized MD5 of a local file with the size and mtime it was computed for
+SEGMENTED_PARTIAL_SUFFIX = ".segmented" # marks a preallocated partial file of an unfinished segmented download
+DEFAULT_DOWNLOAD_WORKERS = 4 # parallel file transfers of ftp_download_many, many servers limit the logins per user
 
 class FtpConfig():
-    def __init__(self,host="localhost", port=2, user="user", password="password"):
+    def __init__(self,host="localhost", port=2, user="user", password="password", download_segments=1,
+                 download_workers=DEFAULT_DOWNLOAD_WORKERS):
         self.host = host
         self.port = port
         self.user = user
         self.password = password
+        self.download_segments = download_segments # parallel connections per large file download
+        self.download_workers = download_workers # parallel file downloads of a task
         
     def save_to_json(self, file_path='config.json'):
         if not os.path.exists(file_path):
@@ -22,6 +35,8 @@ class FtpConfig():
             'port': self.port,
             'user': self.user,
             'password': self.password,
+            'download_segments': self.download_segments,
+            'download_workers': self.download_workers,
         }
         
         with open(file_path, 'w') as json_file:
@@ -41,6 +56,143 @@ class FtpConfig():
         return cls(**ftp_settings)
 
 
+class FtpConnectionPool():
+    """
+    Pool of authenticated FTP control connections to one server.
+
+    A connection is used by a single thread between checkout() and checkin(). Idle connections are
+    checked with NOOP before reuse when they were idle for longer than `validate_after` seconds, and
+    replaced by a new login when the server has closed them.
+    """
+    # Errors after which a connection is still in a known state and can be reused
+    REUSABLE_ERRORS = (ftplib.error_perm,)
+
+    def __init__(self, host, port, user, password, max_idle=4, timeout=60, validate_after=15):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.validate_after = validate_after
+        self._idle = [] # list of (ftp, last_used_time)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        ftp = FTP(timeout=self.timeout)
+        ftp.connect(host=self.host, port=self.port)
+        ftp.login(user=self.user, passwd=self.password)
+        # Use binary mode by default, some servers refuse SIZE in ASCII mode
+        ftp.voidcmd('TYPE I')
+        return ftp
+
+    @staticmethod
+    def _close(ftp):
+        try:
+            ftp.quit()
+        except Exception:
+            ftp.close()
+
+    def checkout(self):
+        """
+        Get a logged in connection, reusing an idle one when it is still alive.
+
+        :return: ftplib.FTP connection owned by the caller until checkin().
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                ftp, last_used = self._idle.pop()
+            if time.time() - last_used < self.validate_after:
+                return ftp
+            try:
+                ftp.voidcmd('NOOP')
+                return ftp
+            except Exception:
+                # Server closed the idle connection (e.g. timeout), drop it and try the next one
+                ftp.close()
+        return self._connect()
+
+    def checkin(self, ftp, broken=False):
+        """
+        Return a connection to the pool.
+
+        :param ftp: Connection obtained from checkout().
+        :param broken: Whether the connection failed and must be closed instead of reused.
+        """
+        if not broken:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append((ftp, time.time()))
+                    return
+        self._close(ftp)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager around checkout() and checkin(). The connection is discarded if the block
+        raises an error that may leave it in an unknown state.
+        """
+        ftp = self.checkout()
+        try:
+            yield ftp
+        except self.REUSABLE_ERRORS:
+            self.checkin(ftp)
+            raise
+        except BaseException:
+            self.checkin(ftp, broken=True)
+            raise
+        else:
+            self.checkin(ftp)
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ftp, _ in idle:
+            self._close(ftp)
+
+
+_ftp_pools = {}
+_ftp_pools_lock = threading.Lock()
+
+def get_ftp_pool(ftp_server, ftp_port, username, password):
+    """
+    Get the shared connection pool of an FTP server and user.
+
+    :param ftp_server: Address of the FTP server.
+    :param ftp_port: Port number of the FTP server.
+    :param username: Username for authentication.
+    :param password: Password for authentication.
+    :return: FtpConnectionPool object.
+    """
+    key = (ftp_server, ftp_port, username, password)
+    with _ftp_pools_lock:
+        pool = _ftp_pools.get(key)
+        if pool is None:
+            pool = FtpConnectionPool(ftp_server, ftp_port, username, password)
+            _ftp_pools[key] = pool
+        return pool
+
+def close_ftp_pools():
+    """
+    Close the idle connections of all shared FTP pools.
+    """
+    with _ftp_pools_lock:
+        pools = list(_ftp_pools.values())
+    for pool in pools:
+        pool.close()
+
+
+def _update_hash_from_file(hash_object, file_path):
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            hash_object.update(chunk)
+    return hash_object
+
 def calculate_md5(file_path):
     """
     Calculate the MD5 checksum of a file.
@@ -48,114 +200,428 @@ def calculate_md5(file_path):
     :param file_path: Path to the file.
     :return: MD5 checksum of the file.
     """
+    return _update_hash_from_file(hashlib.md5(), file_path).hexdigest()
+
+def write_md5_sidecar(file_path, md5_checksum):
+    """
+    Memoize the MD5 checksum of a local file in a sidecar file, together with the size and
+    modification time of the file it belongs to.
+
+    :param file_path: Path to the file.
+    :param md5_checksum: MD5 checksum of the file.
+    """
+    stat = os.stat(file_path)
+    try:
+        with open(file_path + CHECKSUM_SIDECAR_SUFFIX, 'w') as sidecar_file:
+            json.dump({'md5': md5_checksum, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}, sidecar_file)
+    except OSError as e:
+        print(f"Cannot write checksum sidecar of '{file_path}': {e}")
+
+def get_local_md5(file_path):
+    """
+    Get the MD5 checksum of a local file, trusting the memoized value of its sidecar file while the
+    size and modification time of the file are unchanged. Otherwise the file is hashed and the
+    sidecar is rewritten.
+
+    :param file_path: Path to the file.
+    :return: MD5 checksum of the file.
+    """
+    stat = os.stat(file_path)
+    try:
+        with open(file_path + CHECKSUM_SIDECAR_SUFFIX, 'r') as sidecar_file:
+            sidecar = json.load(sidecar_file)
+        if sidecar['size'] == stat.st_size and sidecar['mtime_ns'] == stat.st_mtime_ns:
+            return sidecar['md5']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    md5_checksum = calculate_md5(file_path)
+    write_md5_sidecar(file_path, md5_checksum)
+    return md5_checksum
+
+# FEAT replies of the servers, keyed by (host, port)
+_server_features = {}
+
+def _get_server_features(ftp):
+    """
+    Get the FEAT reply of the server of a connection, sent once per server.
+    """
+    key = (ftp.host, ftp.port)
+    features = _server_features.get(key)
+    if features is None:
+        try:
+            features = ftp.sendcmd("FEAT")
+        except ftplib.error_perm:
+            features = ""
+        _server_features[key] = features
+    return features
+
+def _get_server_md5(ftp, file_path):
+    """
+    Get the MD5 checksum of a file on the server with the XMD5 command when the server advertises it
+    in FEAT, otherwise from the `.md5` file next to it.
+
+    :return: MD5 checksum, or None when the server has no checksum of the file.
+    """
+    if "XMD5" in _get_server_features(ftp):
+        try:
+            response = ftp.sendcmd(f"XMD5 {file_path}")
+            return response.split()[-1].lower()
+        except ftplib.error_perm as e:
+            print(f"XMD5 of '{file_path}' failed: {e}. Falling back to the .md5 file.")
+
+    md5_file_path = file_path + ".md5"
+    # Check if the MD5 file exists on the server
+    try:
+        ftp.size(md5_file_path)
+    except ftplib.error_perm:
+        print(f"MD5 file '{md5_file_path}' does not exist. Proceeding to download the actual file.")
+        return None
+
+    # Read the .md5 file into memory
+    chunks = []
+    ftp.retrbinary(f'RETR {md5_file_path}', chunks.append)
+    content = b"".join(chunks).decode(errors='replace').split()
+    # Check if the MD5 file is empty
+    if not content:
+        print(f"MD5 file '{md5_file_path}' is empty. Proceeding to download the actual file.")
+        return None
+    return content[0].lower()
+
+def _retrieve_file(ftp, file_path, partial_path, file_size, resume, progress):
+    """
+    Retrieve a file with RETR into a partial file, continuing from the end of an existing partial file with REST.
+    The MD5 checksum is computed while the data is received, so the file is not read back afterwards.
+
+    :return: MD5 checksum of the retrieved file.
+    """
     hash_md5 = hashlib.md5()
-    with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
+    # The size of a partial file left by a segmented download says nothing about the bytes received
+    segmented_marker = partial_path + SEGMENTED_PARTIAL_SUFFIX
+    if os.path.exists(segmented_marker):
+        resume = False
+        os.remove(segmented_marker)
+    offset = os.path.getsize(partial_path) if resume and os.path.exists(partial_path) else 0
+    if offset > file_size:
+        offset = 0
+    if offset > 0:
+        print(f"Resuming download of '{file_path}' from byte {offset}.")
+        progress.update(offset)
+        # Only the bytes of the previous attempt are read back
+        _update_hash_from_file(hash_md5, partial_path)
+        if offset == file_size:
+            return hash_md5.hexdigest()
+
+    # Open a local file to write the downloaded data to
+    with open(partial_path, 'ab' if offset > 0 else 'wb') as local_file:
+        # Callback function to hash the data and update progress bar
+        def callback(data):
+            local_file.write(data)
+            hash_md5.update(data)
+            progress.update(len(data))
+
+        # Use RETR command to download the file, REST skips the bytes already downloaded
+        ftp.retrbinary(cmd=f'RETR {file_path}', callback=callback, rest=offset if offset > 0 else None)
     return hash_md5.hexdigest()
 
-def ftp_download(ftp_server, ftp_port, username, password, file_path, force_download=False):
+def _retrieve_segments(pool, file_path, partial_path, file_size, segments, progress):
     """
-    Download a file from an FTP server.
+    Retrieve byte ranges of a file in parallel over several pooled connections into a preallocated file.
+    The partial file is removed when a segment fails.
 
-    :param ftp_server: Address of the FTP server.
-    :param ftp_port: Port number of the FTP server.
-    :param username: Username for authentication.
-    :param password: Password for authentication.
+    :return: MD5 checksum of the retrieved file. The segments arrive out of order, so it is computed
+             in one pass over the assembled file.
+    """
+    # Preallocate the file so every segment can be written at its offset. The marker lives until all segments are
+    # written, so a partial file left by a killed process is never resumed by _retrieve_file
+    segmented_marker = partial_path + SEGMENTED_PARTIAL_SUFFIX
+    open(segmented_marker, 'wb').close()
+    with open(partial_path, 'wb') as local_file:
+        local_file.truncate(file_size)
+
+    segment_size = -(-file_size // segments)
+    ranges = [(start, min(start + segment_size, file_size)) for start in range(0, file_size, segment_size)]
+
+    def retrieve_range(start, end):
+        ftp = pool.checkout()
+        complete = False
+        try:
+            conn = ftp.transfercmd(f'RETR {file_path}', rest=start)
+            remaining = end - start
+            with conn, open(partial_path, 'r+b') as local_file:
+                local_file.seek(start)
+                while remaining > 0:
+                    data = conn.recv(min(SEGMENT_BLOCK_SIZE, remaining))
+                    if not data:
+                        break
+                    local_file.write(data)
+                    remaining -= len(data)
+                    progress.update(len(data))
+            if remaining > 0:
+                raise EOFError(f"Segment {start}-{end} of '{file_path}' ended early")
+            if end == file_size:
+                # The server finished the transfer, read its final reply
+                ftp.voidresp()
+                complete = True
+        finally:
+            # A connection whose transfer was cut short has a pending reply, do not reuse it
+            pool.checkin(ftp, broken=not complete)
+
+    try:
+        # Leaving the executor waits for every segment, so no thread writes to the file afterwards
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(retrieve_range, start, end) for start, end in ranges]
+        for future in futures:
+            future.result()
+    except BaseException:
+        # The preallocated file has the full size with holes where segments failed. A later resume with REST
+        # would trust its size and never fix it, so it is removed
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        os.remove(segmented_marker)
+        raise
+
+    os.remove(segmented_marker)
+    return calculate_md5(partial_path)
+
+def _download_file(ftp, file_path, force_download=False, progress=None, file_cache=None, resume=True, segments=1, pool=None):
+    """
+    Download a file over an open FTP connection, skipping it when the local copy matches the server checksum.
+
+    The server checksum is read with XMD5 when the server supports it, otherwise from the `.md5` file next to the file.
+
+    :param ftp: Logged in ftplib.FTP connection.
     :param file_path: Path to the file on the FTP server.
     :param force_download: Whether to force download the file even if it exists locally.
-    :return: Path of the downloaded file on the local machine if download succeeds, otherwise None.
+    :param progress: Shared tqdm progress bar to report to, a bar for this file is created when None.
+    :param file_cache: LocalFileCache storing files by checksum, files are mirrored under the temp directory when None.
+    :param resume: Whether to continue a partial file left by a failed transfer instead of starting from byte zero.
+    :param segments: Number of parallel connections for files larger than SEGMENTED_DOWNLOAD_MIN_SIZE.
+    :param pool: FtpConnectionPool providing the extra connections of a segmented download.
+    :return: Tuple (local path, server MD5 checksum or None). Raises on error.
     """
-    try:
-        # Connect to the FTP server
-        ftp = FTP()
-        ftp.connect(host=ftp_server, port=ftp_port)
-        ftp.login(user=username, passwd=password)
-
-        # Get the file name from the file path
-        filename = file_path.split('/')[-1]
-        md5_file_path = file_path + ".md5"
-
-        # Define the base directory based on the operating system
-        if os.name == 'nt':  # Windows
-            base_dir = "C:\\temp"
-        else:  # Unix-like systems
-            base_dir = "/tmp"
-
-        # Define the local path in the /tmp directory, creating corresponding directories
-        local_dir = os.path.join(base_dir, os.path.dirname(file_path).lstrip('/'))
-        os.makedirs(local_dir, exist_ok=True)
-        local_path = os.path.join(local_dir, filename)
-        local_md5_path = local_path + ".md5"
-
-        # Check if the MD5 file exists on the server
-        md5_file_exists = True
-        try:
-            ftp.size(md5_file_path)
-        except ftplib.error_perm:
-            md5_file_exists = False
+    # Get the file name from the file path
+    filename = file_path.split('/')[-1]
+
+    # Define the base directory based on the operating system
+    if os.name == 'nt':  # Windows
+        base_dir = "C:\\temp"
+    else:  # Unix-like systems
+        base_dir = "/tmp"
+
+    # Define the local path in the /tmp directory, creating corresponding directories
+    local_dir = os.path.join(base_dir, os.path.dirname(file_path).lstrip('/'))
+    os.makedirs(local_dir, exist_ok=True)
+    local_path = os.path.join(local_dir, filename)
+
+    server_md5_checksum = _get_server_md5(ftp, file_path)
+    if server_md5_checksum is None:
+        force_download = True
+    elif file_cache is not None:
+        # The cache is keyed by checksum, a hit needs no rehash of the local file
+        cached_path = file_cache.get(server_md5_checksum)
+        if cached_path is not None and not force_download:
+            print(f"File '{filename}' found in the local file cache at '{cached_path}'.")
+            return cached_path, server_md5_checksum
+    # Check if the local file exists and compare checksums, the memoized checksum avoids a rehash
+    elif os.path.exists(local_path):
+        local_md5_checksum = get_local_md5(local_path)
+        if local_md5_checksum == server_md5_checksum and not force_download:
+            print(f"File '{filename}' already exists with matching checksum at '{local_path}'.")
+            return local_path, server_md5_checksum
+
+    # Files with a known checksum go through the file cache. The data is first written to a partial
+    # file that survives failed transfers so the next attempt can resume it
+    use_file_cache = file_cache is not None and server_md5_checksum is not None
+    partial_path = file_cache.incoming_path(filename, server_md5_checksum) if use_file_cache else local_path + ".part"
+
+    # Only one process writes a given partial file
+    with FileLock(partial_path + ".lock", remove=True):
+        if use_file_cache and not force_download:
+            cached_path = file_cache.get(server_md5_checksum)
+            if cached_path is not None:
+                print(f"File '{filename}' was downloaded to the local file cache by another worker.")
+                return cached_path, server_md5_checksum
 
-        if md5_file_exists:
-            # Download the .md5 file
-            with open(local_md5_path, 'wb') as local_md5_file:
-                ftp.retrbinary(f'RETR {md5_file_path}', local_md5_file.write)
-            
-            # Check if the MD5 file is empty
-            if os.path.getsize(local_md5_path) == 0:
-                print(f"MD5 file '{md5_file_path}' is empty. Proceeding to download the actual file.")
-                force_download = True
+        # Get the size of the file
+        file_size = ftp.size(file_path)
+
+        if progress is None:
+            file_progress = tqdm(total=file_size, desc=f'Downloading {filename}', unit='B', unit_scale=True)
+        else:
+            file_progress = progress
+            # Grow the total of the shared progress bar as the sizes become known
+            with progress.get_lock():
+                progress.total += file_size
+                progress.refresh()
+
+        try:
+            if segments > 1 and pool is not None and file_size >= SEGMENTED_DOWNLOAD_MIN_SIZE:
+                local_md5_checksum = _retrieve_segments(pool, file_path, partial_path, file_size, segments, file_progress)
             else:
-                # Read the checksum from the .md5 file
-                with open(local_md5_path, 'r') as local_md5_file:
-                    server_md5_checksum = local_md5_file.read().split()[0]
-
-                # Check if the local file exists and compare checksums
-                if os.path.exists(local_path):
-                    local_md5_checksum = calculate_md5(local_path)
-                    if local_md5_checksum == server_md5_checksum and not force_download:
-                        print(f"File '{filename}' already exists with matching checksum at '{local_path}'.")
-                        # Remove the local MD5 file if it exists
-                        if os.path.exists(local_md5_path):
-                            os.remove(local_md5_path)
-                        return local_path
+                # A partial file can only be resumed when the result can be verified against the checksum
+                local_md5_checksum = _retrieve_file(ftp, file_path, partial_path, file_size,
+                                                    resume and server_md5_checksum is not None, file_progress)
+        finally:
+            if progress is None:
+                file_progress.close()
+
+        if server_md5_checksum is not None and local_md5_checksum != server_md5_checksum:
+            os.remove(partial_path)
+            raise ValueError(f"Checksum mismatch after downloading '{file_path}'")
+
+        if use_file_cache:
+            local_path = file_cache.put(server_md5_checksum, partial_path)
         else:
-            print(f"MD5 file '{md5_file_path}' does not exist. Proceeding to download the actual file.")
-            force_download = True
+            os.replace(partial_path, local_path)
+            # Later checks of the local copy trust this checksum while the file is unchanged
+            write_md5_sidecar(local_path, local_md5_checksum)
 
-        # Get the size of the file
-        file_size = ftp.size(file_path)
+    print(f"File '{filename}' downloaded successfully to '{local_path}'.")
 
-        # Open a local file to write the downloaded data to
-        with open(local_path, 'wb') as local_file, tqdm(
-            total=file_size,
-            desc=f'Downloading {filename}',
-            unit='B',
-            unit_scale=True
-        ) as progress:
-            # Callback function to update progress bar
-            def callback(data):
-                local_file.write(data)
-                progress.update(len(data))
+    # Return the path of the downloaded file
+    return local_path, server_md5_checksum
+
+def _download_to_memory(ftp, file_path, progress=None):
+    """
+    Download a file over an open FTP connection into a memory buffer, without touching the disk.
+
+    :param ftp: Logged in ftplib.FTP connection.
+    :param file_path: Path to the file on the FTP server.
+    :param progress: Shared tqdm progress bar to report to, a bar for this file is created when None.
+    :return: Tuple (bytearray with the file content, server MD5 checksum or None). Raises on error.
+    """
+    filename = file_path.split('/')[-1]
+    server_md5_checksum = _get_server_md5(ftp, file_path)
+
+    # Get the size of the file
+    file_size = ftp.size(file_path)
 
-            # Use RETR command to download the file
-            ftp.retrbinary(cmd=f'RETR {file_path}', callback=callback)
+    if progress is None:
+        file_progress = tqdm(total=file_size, desc=f'Downloading {filename}', unit='B', unit_scale=True)
+    else:
+        file_progress = progress
+        with progress.get_lock():
+            progress.total += file_size
+            progress.refresh()
 
-        print(f"File '{filename}' downloaded successfully to '{local_path}'.")
-        # Remove the local MD5 file if it exists
-        if os.path.exists(local_md5_path):
-            os.remove(local_md5_path)
+    buffer = bytearray()
+    hash_md5 = hashlib.md5()
+    try:
+        def callback(data):
+            buffer.extend(data)
+            hash_md5.update(data)
+            file_progress.update(len(data))
+
+        ftp.retrbinary(cmd=f'RETR {file_path}', callback=callback)
+    finally:
+        if progress is None:
+            file_progress.close()
+
+    if server_md5_checksum is not None and hash_md5.hexdigest() != server_md5_checksum:
+        raise ValueError(f"Checksum mismatch after downloading '{file_path}'")
 
-        # Return the path of the downloaded file
-        return local_path
+    print(f"File '{filename}' downloaded successfully into memory.")
+    return buffer, server_md5_checksum
 
+def ftp_download_to_memory(ftp_server, ftp_port, username, password, file_path, return_checksum=False):
+    """
+    Download a small file from an FTP server into memory, e.g. a template image to decode with cv2.imdecode.
+
+    :param ftp_server: Address of the FTP server.
+    :param ftp_port: Port number of the FTP server.
+    :param username: Username for authentication.
+    :param password: Password for authentication.
+    :param file_path: Path to the file on the FTP server.
+    :param return_checksum: Whether to also return the MD5 checksum of the server.
+    :return: bytearray with the file content if download succeeds, otherwise None.
+             If return_checksum is True, a tuple (content, checksum).
+    """
+    pool = get_ftp_pool(ftp_server, ftp_port, username, password)
+    try:
+        with pool.connection() as ftp:
+            content, server_md5_checksum = _download_to_memory(ftp, file_path)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return None
+        return (None, None) if return_checksum else None
 
-    finally:
-        # Close the FTP connection
-        if ftp:
-            ftp.quit()
+    return (content, server_md5_checksum) if return_checksum else content
+
+def ftp_download(ftp_server, ftp_port, username, password, file_path, force_download=False, return_checksum=False, file_cache=None,
+                 resume=True, segments=1):
+    """
+    Download a file from an FTP server.
+
+    :param ftp_server: Address of the FTP server.
+    :param ftp_port: Port number of the FTP server.
+    :param username: Username for authentication.
+    :param password: Password for authentication.
+    :param file_path: Path to the file on the FTP server.
+    :param force_download: Whether to force download the file even if it exists locally.
+    :param return_checksum: Whether to also return the MD5 checksum of the server (XMD5 or `.md5` file).
+    :param file_cache: Optional LocalFileCache storing files with a server checksum by checksum.
+    :param resume: Whether to continue a partial file left by a failed transfer (REST), only for files with a server checksum.
+    :param segments: Number of parallel connections fetching byte ranges of files larger than SEGMENTED_DOWNLOAD_MIN_SIZE.
+    :return: Path of the downloaded file on the local machine if download succeeds, otherwise None.
+             If return_checksum is True, a tuple (path, checksum) where checksum is None when the server has no checksum of the file.
+    """
+    pool = get_ftp_pool(ftp_server, ftp_port, username, password)
+    try:
+        # Get a logged in connection from the pool
+        with pool.connection() as ftp:
+            local_path, server_md5_checksum = _download_file(ftp, file_path, force_download, file_cache=file_cache,
+                                                             resume=resume, segments=segments, pool=pool)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return (None, None) if return_checksum else None
+
+    return (local_path, server_md5_checksum) if return_checksum else local_path
+
+def ftp_download_many(ftp_server, ftp_port, username, password, file_paths, force_download=False, max_workers=None, file_cache=None,
+                      resume=True, segments=1, in_memory_paths=()):
+    """
+    Download several files from an FTP server in parallel, each over its own connection.
+
+    :param ftp_server: Address of the FTP server.
+    :param ftp_port: Port number of the FTP server.
+    :param username: Username for authentication.
+    :param password: Password for authentication.
+    :param file_paths: Paths to the files on the FTP server.
+    :param force_download: Whether to force download the files even if they exist locally.
+    :param max_workers: Maximum number of parallel transfers, defaults to DEFAULT_DOWNLOAD_WORKERS.
+    :param file_cache: Optional LocalFileCache storing files with a server checksum by checksum.
+    :param resume: Whether to continue partial files left by failed transfers, see ftp_download.
+    :param segments: Number of parallel connections per large file, see ftp_download.
+    :param in_memory_paths: Remote paths of small files to download into memory instead of to disk.
+    :return: Tuple (downloads, errors): downloads maps each remote path to (local path, server MD5 checksum or None)
+             for the succeeded files, with a bytearray of the content instead of the local path for in_memory_paths,
+             errors maps each remote path to its error message for the failed ones.
+    """
+    pool = get_ftp_pool(ftp_server, ftp_port, username, password)
+    file_paths = list(dict.fromkeys(file_paths))
+    in_memory_paths = set(in_memory_paths)
+    downloads = {}
+    errors = {}
+
+    def download(file_path):
+        with pool.connection() as ftp:
+            if file_path in in_memory_paths:
+                return _download_to_memory(ftp, file_path, progress=progress)
+            return _download_file(ftp, file_path, force_download, progress=progress, file_cache=file_cache,
+                                  resume=resume, segments=segments, pool=pool)
+
+    with tqdm(total=0, desc=f'Downloading {len(file_paths)} files', unit='B', unit_scale=True) as progress, \
+            ThreadPoolExecutor(max_workers=max(min(max_workers or DEFAULT_DOWNLOAD_WORKERS, len(file_paths)), 1)) as executor:
+        futures = {executor.submit(download, file_path): file_path for file_path in file_paths}
+        for future in as_completed(futures):
+            file_path = futures[future]
+            try:
+                downloads[file_path] = future.result()
+            except Exception as e:
+                print(f"An error occurred downloading '{file_path}': {e}")
+                errors[file_path] = str(e)
+
+    return downloads, errors
 
 
 def ftp_upload(ftp_server, ftp_port, username, password, local_file_path, remote_directory):
@@ -170,14 +636,12 @@ def ftp_upload(ftp_server, ftp_port, username, password, local_file_path, remote
     :param remote_directory: Path to the directory on the FTP server where the file will be uploaded.
     :return: File path in the FTP server if upload succeeds, otherwise None.
     """
-    ftp = FTP()
+    pool = get_ftp_pool(ftp_server, ftp_port, username, password)
+    ftp = None
+    broken = False
     try:
-        # Connect to the FTP server
-        ftp.connect(host=ftp_server, port=ftp_port)
-        ftp.login(user=username, passwd=password)
-
-        # Change to the remote directory
-        ftp.cwd(remote_directory)
+        # Get a logged in connection from the pool
+        ftp = pool.checkout()
 
         # Get the file name from the local file path
         filename = os.path.basename(local_file_path)
@@ -196,8 +660,8 @@ def ftp_upload(ftp_server, ftp_port, username, password, local_file_path, remote
             def callback(data):
                 progress.update(len(data))
 
-            # Use STOR command to upload the file
-            ftp.storbinary(cmd=f'STOR {filename}', fp=local_file, callback=callback)
+            # Use STOR command with the full remote path, pooled connections keep their working directory
+            ftp.storbinary(cmd=f"STOR {remote_directory.rstrip('/')}/{filename}", fp=local_file, callback=callback)
 
         print(f"File '{filename}' uploaded successfully.")
 
@@ -206,12 +670,13 @@ def ftp_upload(ftp_server, ftp_port, username, password, local_file_path, remote
 
     except Exception as e:
         print(f"An error occurred: {e}")
+        broken = not isinstance(e, pool.REUSABLE_ERRORS)
         return None
 
     finally:
-        # Close the FTP connection
+        # Return the FTP connection to the pool
         if ftp:
-            ftp.quit()
+            pool.checkin(ftp, broken=broken)
             
 def get_server_checksum(ftp_server, ftp_port, username, password, file_path):
     """
@@ -224,14 +689,15 @@ def get_server_checksum(ftp_server, ftp_port, username, password, file_path):
     :param file_path: Path to the file on the FTP server.
     :return: Checksum of the file if supported and successful, otherwise None.
     """
+    pool = get_ftp_pool(ftp_server, ftp_port, username, password)
+    ftp = None
+    broken = False
     try:
-        # Connect to the FTP server
-        ftp = FTP()
-        ftp.connect(host=ftp_server, port=ftp_port)
-        ftp.login(user=username, passwd=password)
+        # Get a logged in connection from the pool
+        ftp = pool.checkout()
 
         # Check for supported features
-        features = ftp.sendcmd("FEAT")
+        features = _get_server_features(ftp)
         print(features)
         checksum_command = None
 
@@ -256,12 +722,13 @@ def get_server_checksum(ftp_server, ftp_port, username, password, file_path):
 
     except Exception as e:
         print(f"An error occurred: {e}")
+        broken = not isinstance(e, pool.REUSABLE_ERRORS)
         return None
 
     finally:
-        # Close the FTP connection
+        # Return the FTP connection to the pool
         if ftp:
-            ftp.quit()
+            pool.checkin(ftp, broken=broken)
             
 if __name__ == "__main__":
     ftp_config =FtpConfig().read_from_json("./config.json")
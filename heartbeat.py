@@ -0,0 +1,142 @@
+from sqlalchemy import update, bindparam, text
+from sqlalchemy.exc import SQLAlchemyError
+from datetime import datetime
+import random, threading, time
+
+from database import AvtTask, TASK_STAT_CLAIMED
+
+
+class TaskHeartbeat():
+    """
+    Background writer of the running time of a task into its task_stat.
+
+    Each beat is a single parameterized UPDATE of task_stat and updated_at sent over a dedicated
+    connection, without an ORM session or a SELECT of the row. Beats are spaced by `interval` seconds
+    with a random jitter so that many workers do not write in lockstep. A beat that fails or times
+    out (e.g. the database briefly stalls) drops the connection, and the next beat reconnects; beats
+    missed meanwhile are not replayed. The final status of the task is written by finish() over the
+    same connection, which replaces the last beat.
+    """
+    # Beats and the final write give up after this time instead of blocking the task
+    STATEMENT_TIMEOUT_MS = 5000
+    FINAL_WRITE_ATTEMPTS = 3
+
+    _beat_query = update(AvtTask).where(AvtTask.id == bindparam('task_id')).values(
+        task_stat=bindparam('task_stat'),
+        updated_at=bindparam('updated_at')
+    )
+
+    def __init__(self, db, task_id, interval=1.0, jitter=0.2):
+        """
+        :param db: Database object.
+        :param task_id: Id of the running task.
+        :param interval: Seconds between beats.
+        :param jitter: Random variation of the interval, as a fraction of it.
+        """
+        self.db = db
+        self.task_id = task_id
+        self.interval = interval
+        self.jitter = jitter
+        self._connection = None
+        self._connection_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._start_time = None
+
+    def _connect(self):
+        connection = self.db.engine.connect()
+        # Take the connection out of the engine pool, its session settings must not leak to other users
+        connection.detach()
+        if self.db.engine.dialect.name == 'postgresql':
+            connection.execute(text(f"SET statement_timeout = {int(self.STATEMENT_TIMEOUT_MS)}"))
+            connection.commit()
+        return connection
+
+    def _execute(self, query, params):
+        """
+        Execute and commit one statement on the dedicated connection, reconnecting if needed.
+        Must be called with the connection lock held.
+        """
+        try:
+            if self._connection is None:
+                self._connection = self._connect()
+            self._connection.execute(query, params)
+            self._connection.commit()
+            return True
+        except SQLAlchemyError as e:
+            print(f"Heartbeat of task {self.task_id}: write failed: {e}")
+            self._close_connection()
+            return False
+
+    def _close_connection(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except SQLAlchemyError:
+                pass
+            self._connection = None
+
+    def _next_delay(self):
+        return max(0.0, self.interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def _run(self):
+        while not self._stop_event.wait(self._next_delay()):
+            elapsed_time = time.time() - self._start_time
+            # task_stat is an integer: 0 and 1 mean error and finished, so running tasks never report less than the claim value
+            params = {'task_id': self.task_id, 'task_stat': max(int(elapsed_time), TASK_STAT_CLAIMED), 'updated_at': datetime.now()}
+            with self._connection_lock:
+                if self._stop_event.is_set():
+                    break
+                self._execute(self._beat_query, params)
+            # TODO: check processing resource and update task ETA here
+        print(f"Running time thread for task {self.task_id} stopped.")
+
+    def start(self):
+        """
+        Start the beats in a daemon thread.
+        """
+        self._start_time = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def finish(self, task_stat, task_output=None, task_message=None):
+        """
+        Stop the beats and write the final status of the task in a single UPDATE.
+
+        :param task_stat: Final task_stat (1 finished, 0 error).
+        :param task_output: Output of the task.
+        :param task_message: Status message of the task.
+        :return: True if the final status was written, otherwise False.
+        """
+        self._stop_event.set()
+        final_query = update(AvtTask).where(AvtTask.id == self.task_id).values(
+            task_stat=task_stat,
+            task_output=task_output,
+            task_message=task_message,
+            updated_at=datetime.now()
+        )
+        success = False
+        # Taking the lock waits for a beat in flight, so it can never overwrite the final status
+        with self._connection_lock:
+            for attempt in range(self.FINAL_WRITE_ATTEMPTS):
+                if self._execute(final_query, {}):
+                    success = True
+                    break
+                if attempt < self.FINAL_WRITE_ATTEMPTS - 1:
+                    time.sleep(min(2 ** attempt, 5))
+            self._close_connection()
+
+        if self._thread is not None:
+            self._thread.join()
+        return success
+
+    def stop(self):
+        """
+        Stop the beats without writing a final status. Safe to call after finish() or more than once.
+        """
+        self._stop_event.set()
+        with self._connection_lock:
+            self._close_connection()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,134 @@
+import numbers
+import time
+
+import cv2
+import numpy as np
+
+# Robust estimation methods of cv2.findHomography
+ESTIMATORS = {
+    "ransac": cv2.RANSAC,
+    "magsac": cv2.USAC_MAGSAC,
+    "prosac": cv2.USAC_PROSAC,
+    "accurate": cv2.USAC_ACCURATE,
+}
+
+DEFAULT_HOMOGRAPHY_ESTIMATOR = "ransac"
+
+# Minimum number of correspondences of a homography
+HOMOGRAPHY_MIN_POINTS = 4
+
+
+class HomographyEstimator():
+    """
+    Robust estimation settings of the homography from the template to the main image.
+
+    "ransac" is the classic RANSAC of OpenCV. The USAC methods need fewer iterations at low inlier ratios:
+    "magsac" (MAGSAC++ scoring, no hard threshold), "prosac" (samples the best matches first, the points are
+    ordered by their ratio test score) and "accurate" (graph-cut local optimization).
+    """
+    def __init__(self, name=DEFAULT_HOMOGRAPHY_ESTIMATOR, reprojection_threshold=5.0, confidence=0.995,
+                 max_iters=2000, affine_precheck=False, max_anisotropy=20.0):
+        """
+        :param name: "ransac", "magsac", "prosac" or "accurate".
+        :param reprojection_threshold: Maximum reprojection error in pixels of an inlier (the maximum threshold for "magsac").
+        :param confidence: Confidence of the result, the estimation stops as soon as it is reached.
+        :param max_iters: Maximum number of iterations.
+        :param affine_precheck: Estimate an affine transformation first and skip the homography estimation when
+                                it is degenerate or has fewer than 4 inliers.
+        :param max_anisotropy: Largest ratio of the singular values of the linear part of an accepted affine
+                               transformation, larger ratios collapse the template to a line.
+        """
+        self.name = name
+        self.method = ESTIMATORS[name]
+        self.reprojection_threshold = reprojection_threshold
+        self.confidence = confidence
+        self.max_iters = max_iters
+        self.affine_precheck = affine_precheck
+        self.max_anisotropy = max_anisotropy
+
+    def is_degenerate(self, linear):
+        """
+        Check the 2x2 linear part of an affine transformation: mirrored, collapsed or too anisotropic.
+        """
+        if not np.all(np.isfinite(linear)) or np.linalg.det(linear) <= 0:
+            return True
+        singular_values = np.linalg.svd(linear, compute_uv=False)
+        return singular_values[0] > self.max_anisotropy * singular_values[1]
+
+    def estimate(self, src_pts, dst_pts, scores=None):
+        """
+        Estimate the homography mapping src_pts to dst_pts.
+
+        :param src_pts: float32 array of shape (N, 1, 2), template points.
+        :param dst_pts: float32 array of shape (N, 1, 2), main image points.
+        :param scores: Match scores, lower is better (e.g. the ratio test score). "prosac" samples the points
+                       in this order, the other methods ignore it.
+        :return: (M, mask, estimation). M is the 3x3 homography or None, mask the boolean inlier mask of the
+                 points or None, estimation a dict with "estimator", "matches", "inliers", "estimator_time"
+                 (seconds) and "reason" when no homography is returned.
+        """
+        start = time.perf_counter()
+        M, mask, reason = self._estimate(src_pts, dst_pts, scores)
+        estimation = {"estimator": self.name, "matches": len(src_pts),
+                      "inliers": int(mask.sum()) if mask is not None else 0,
+                      "estimator_time": time.perf_counter() - start}
+        if reason is not None:
+            estimation["reason"] = reason
+        return M, mask, estimation
+
+    def _estimate(self, src_pts, dst_pts, scores):
+        if self.affine_precheck:
+            # A cheap 3 point model: without a consistent affine motion there is no usable homography either
+            A, affine_mask = cv2.estimateAffine2D(src_pts, dst_pts, method=cv2.RANSAC,
+                                                  ransacReprojThreshold=self.reprojection_threshold,
+                                                  maxIters=self.max_iters, confidence=self.confidence)
+            if A is None or affine_mask.sum() < HOMOGRAPHY_MIN_POINTS:
+                return None, None, "too few affine inliers"
+            if self.is_degenerate(A[:, :2]):
+                return None, None, "degenerate affine transformation"
+
+        order = None
+        if self.name == "prosac" and scores is not None:
+            order = np.argsort(scores, kind='stable')
+            src_pts, dst_pts = src_pts[order], dst_pts[order]
+
+        M, mask = cv2.findHomography(src_pts, dst_pts, self.method, self.reprojection_threshold,
+                                     maxIters=self.max_iters, confidence=self.confidence)
+        if M is None:
+            return None, None, "no homography"
+        mask = mask.ravel().astype(bool)
+        if order is not None:
+            unordered = np.empty_like(mask)
+            unordered[order] = mask
+            mask = unordered
+        return M, mask, None
+
+
+def _is_real(value):
+    # Booleans are integers in Python, they are not accepted as settings
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+def _is_integer(value):
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+
+
+def get_homography_estimator(name=DEFAULT_HOMOGRAPHY_ESTIMATOR, reprojection_threshold=5.0, confidence=0.995,
+                             max_iters=2000, affine_precheck=False):
+    """
+    Get homography estimation settings by estimator name.
+
+    :param name: "ransac" (default), "magsac", "prosac" or "accurate", or a HomographyEstimator returned as is.
+    :param reprojection_threshold, confidence, max_iters, affine_precheck: See HomographyEstimator.
+    :return: HomographyEstimator, or None if the estimator is unknown or the settings are not numbers in range.
+    """
+    if isinstance(name, HomographyEstimator):
+        return name
+    if not isinstance(name, str) or name not in ESTIMATORS:
+        print(f"Unknown homography estimator '{name}', expected one of {tuple(ESTIMATORS)}.")
+        return None
+    if (not _is_real(confidence) or not _is_integer(max_iters) or not _is_real(reprojection_threshold)
+            or not 0 < confidence < 1 or max_iters < 1 or not reprojection_threshold > 0):
+        print(f"Invalid homography estimation settings: confidence {confidence!r}, max_iters {max_iters!r}, "
+              f"reprojection_threshold {reprojection_threshold!r}.")
+        return None
+    return HomographyEstimator(name, reprojection_threshold, confidence, max_iters, affine_precheck)
@@ -0,0 +1,157 @@
+import cv2
+import numpy as np
+
+# Exact nearest neighbour search on keypoint positions: single KD-tree searched without a checks limit
+FLANN_INDEX_KDTREE_SINGLE = 4
+FLANN_CHECKS_UNLIMITED = -1
+
+KEYPOINT_BUDGET_METHODS = ("grid", "anms")
+
+
+def grid_top_k(keypoints, budget, grid_size=16):
+    """
+    Select keypoints spread over the image: the bounding box of the keypoints is split into a grid and
+    every cell keeps its strongest keypoints by response, up to an equal share of the budget.
+
+    :param keypoints: Structured keypoint array with KEYPOINT_DTYPE fields.
+    :param budget: Maximum number of selected keypoints.
+    :param grid_size: Number of cells along the longest side of the bounding box, proportionally fewer along the other side.
+    :return: Sorted indices of the selected keypoints, exactly `budget` of them when there are more keypoints.
+             The share left unused by cells holding fewer keypoints is filled with the next-ranked keypoints of
+             the other cells, the strongest first among equal ranks.
+    """
+    if len(keypoints) <= budget:
+        return np.arange(len(keypoints))
+    x, y = keypoints['x'].astype(np.float64), keypoints['y'].astype(np.float64)
+    width, height = max(x.max() - x.min(), 1.0), max(y.max() - y.min(), 1.0)
+    cell_size = max(width, height) / grid_size
+    cols, rows = max(1, int(np.ceil(width / cell_size))), max(1, int(np.ceil(height / cell_size)))
+    col = np.minimum(((x - x.min()) / cell_size).astype(np.int64), cols - 1)
+    row = np.minimum(((y - y.min()) / cell_size).astype(np.int64), rows - 1)
+    cell = row * cols + col
+
+    # Rank of every keypoint inside its cell, strongest first
+    order = np.lexsort((-keypoints['response'], cell))
+    sorted_cell = cell[order]
+    cell_start = np.searchsorted(sorted_cell, sorted_cell, side='left')
+    rank = np.arange(len(order)) - cell_start
+
+    per_cell = max(1, budget // (cols * rows))
+    selected = order[rank < per_cell]
+    if len(selected) > budget:
+        # Small budgets on a large grid: keep the strongest of the per-cell winners
+        selected = selected[np.argsort(-keypoints['response'][selected], kind='stable')[:budget]]
+    elif len(selected) < budget:
+        # Second pass over the rest: lowest rank in its cell first, then the strongest
+        rest = np.flatnonzero(rank >= per_cell)
+        rest = rest[np.lexsort((-keypoints['response'][order[rest]], rank[rest]))]
+        selected = np.concatenate((selected, order[rest[:budget - len(selected)]]))
+    return np.sort(selected)
+
+
+def anms_radii(keypoints, budget, robustness=0.9):
+    """
+    Suppression radii of adaptive non-maximal suppression (Brown et al. 2005): the distance of every keypoint
+    to the nearest keypoint that is sufficiently stronger (its response times robustness is above the response
+    of the keypoint).
+
+    Radii are found with exact k nearest neighbour searches on the keypoint positions. A keypoint without a
+    stronger neighbour among its k nearest only gets the distance of its k-th neighbour, a lower bound of its
+    radius, and the search is repeated with a doubled k for the keypoints whose lower bound does not exceed the
+    `budget`-th largest radius. The `budget` largest values are therefore the `budget` largest radii, although
+    some of them may be lower bounds.
+
+    :param keypoints: Structured keypoint array with KEYPOINT_DTYPE fields.
+    :param budget: Number of keypoints that will be selected by radius, less than the number of keypoints.
+    :param robustness: Factor applied to the response of the stronger keypoint, at most 1 (default: 0.9).
+    :return: float64 array of radii, np.inf for keypoints without any stronger keypoint. Lower bounds are only
+             refined while they can change the selection.
+    """
+    count = len(keypoints)
+    points = np.stack((keypoints['x'], keypoints['y']), axis=-1).astype(np.float32)
+    response = keypoints['response'].astype(np.float64)
+    index = cv2.flann_Index(points, dict(algorithm=FLANN_INDEX_KDTREE_SINGLE))
+    search_params = dict(checks=FLANN_CHECKS_UNLIMITED)
+
+    # Keypoints within robustness of the strongest one have no stronger keypoint at all
+    radii = np.zeros(count)
+    exact = response >= response.max() * robustness
+    radii[exact] = np.inf
+    pending = np.flatnonzero(~exact)
+    k = min(count, 8)
+    while len(pending):
+        indices, distances = index.knnSearch(points[pending], k, params=search_params)
+        distances = distances.astype(np.float64)
+        stronger = response[indices] * robustness > response[pending, None]
+        nearest = np.where(stronger, distances, np.inf).min(axis=1)
+        found = np.isfinite(nearest)
+        radii[pending[found]] = np.sqrt(nearest[found])
+        exact[pending[found]] = True
+
+        unresolved = pending[~found]
+        if k >= count:
+            # All keypoints were searched: no stronger keypoint at all
+            radii[unresolved] = np.inf
+            exact[unresolved] = True
+        else:
+            radii[unresolved] = np.sqrt(distances[~found, -1])
+        # Lower bounds above the threshold are selected whatever their exact radius, the others are searched further
+        threshold = np.partition(radii, count - budget)[count - budget]
+        if np.isinf(threshold):
+            # The selection is made of keypoints without any stronger keypoint
+            break
+        pending = np.flatnonzero(~exact & (radii <= threshold))
+        k = min(count, k * 2)
+    return radii
+
+
+def anms(keypoints, budget, robustness=0.9):
+    """
+    Select the keypoints with the largest suppression radii, see anms_radii: strong keypoints spread evenly
+    over the image instead of clustered in textured areas.
+
+    :param keypoints: Structured keypoint array with KEYPOINT_DTYPE fields.
+    :param budget: Maximum number of selected keypoints.
+    :param robustness: See anms_radii (default: 0.9).
+    :return: Sorted indices of the selected keypoints.
+    """
+    if len(keypoints) <= budget:
+        return np.arange(len(keypoints))
+    radii = anms_radii(keypoints, budget, robustness)
+    # Largest radii first, the strongest first among equal radii
+    return np.sort(np.lexsort((-keypoints['response'], -radii))[:budget])
+
+
+def apply_keypoint_budget(keypoints, descriptors, budget=None, method="grid", grid_size=16, robustness=0.9):
+    """
+    Keep at most `budget` keypoints and their descriptors.
+
+    :param keypoints: Structured keypoint array with KEYPOINT_DTYPE fields.
+    :param descriptors: Descriptors of the keypoints, or None.
+    :param budget: Maximum number of keypoints, at least 1, no selection when None.
+    :param method: "grid" for grid_top_k or "anms" for anms.
+    :param grid_size: See grid_top_k.
+    :param robustness: See anms_radii.
+    :return: (keypoints, descriptors) of the selected keypoints.
+    """
+    if budget is not None and budget < 1:
+        raise ValueError(f"Keypoint budget must be at least 1, got {budget}")
+    if budget is None or descriptors is None or len(keypoints) <= budget:
+        return keypoints, descriptors
+    if method == "anms":
+        selected = anms(keypoints, budget, robustness)
+    else:
+        selected = grid_top_k(keypoints, budget, grid_size)
+    print(f"Keypoint budget: kept {len(selected)} of {len(keypoints)} keypoints ({method}).")
+    return keypoints[selected], descriptors[selected]
+
+
+def keypoint_budget_variant(budget=None, method="grid", grid_size=16, robustness=0.9):
+    """
+    Suffix of the feature cache variant for a keypoint budget, empty without budget.
+    """
+    if budget is None:
+        return ""
+    if method == "anms":
+        return f"_anms{budget}_r{robustness}"
+    return f"_grid{budget}_g{grid_size}"
@@ -1,12 +1,21 @@
 import cv2
-from template_matching_sift_based import sift_flann_ransac_matching
+from feature_backends import get_feature_backend, DEFAULT_FEATURE_BACKEND
+from keypoint_budget import KEYPOINT_BUDGET_METHODS
+from homography_estimators import get_homography_estimator, DEFAULT_HOMOGRAPHY_ESTIMATOR
+from template_matching_sift_based import sift_flann_ransac_matching, pyramid_sift_flann_ransac_matching, sift_flann_ransac_matching_batch, DEFAULT_PREVIEW_MAX_SIZE, EXTRACTION_MODES, RENDER_MODES
 from ftp_connector import *
 from database import Database, DatabaseConfig
 import argparse
+import multiprocessing
+import signal
+import threading
 import json
 import sys
 from exit_code import *
 from utils import polygon_to_latlon
+from feature_cache import FeatureCache
+from file_cache import LocalFileCache
+from heartbeat import TaskHeartbeat
 
 
 FTP_SERVER_OUTPUT_DIR = "/output/template_matching"
@@ -51,6 +60,12 @@ def save_and_upload_images(result_image, cropped_result, avt_task_id, ftp_config
     
     return uploaded_result_image_path, uploaded_result_croped_path
 
+def is_int_at_least(value, minimum):
+    """
+    Check a task parameter that must be an integer (not a boolean) of at least `minimum`.
+    """
+    return isinstance(value, int) and not isinstance(value, bool) and value >= minimum
+
 def create_output_json(result_image_file, cropped_image_file, bbox):
     """
     Create a JSON string with the specified format.
@@ -68,44 +83,294 @@ def create_output_json(result_image_file, cropped_image_file, bbox):
 
     return json.dumps(output_dict, separators=(',', ':'))
 
-def create_output_location_json(bbox):
+def create_output_location_json(bbox, estimation=None):
     """
     Create a JSON string with the specified format.
 
     :param bbox: List of points (latitude, longitude) of the bounding box or None.
+    :param estimation: Inlier count and estimator time of the homography, see find_template_homography, or None.
     :return: JSON string.
     """
     output_dict = {
-        "location": bbox if bbox is not None else []
+        "location": bbox if bbox is not None else [],
+        "estimation": estimation
     }
 
     return json.dumps(output_dict, separators=(',', ':'))
 
-# Function to print running time
-import threading
-import time
-
-def update_running_time(task_id, db : Database, stop_event):
-    start_time = time.time()
-    while not stop_event.is_set():
-        elapsed_time = time.time() - start_time 
-        # print(f"Running time {running_time}")
-        if elapsed_time > 2: # only update running time > 2 in task_stat to avoid confilict with tast_stat=1 (finished) or task_stat = 0 (error)
-            db.update_task(task_id, task_stat=round(elapsed_time, 1))
-        else:
-            db.update_task(task_id, task_stat=round(elapsed_time, 2))
-        # TODO: check processing resource and update task ETA here
-        
-        time.sleep(0.5)  # Update every second
+def create_output_batch_location_json(template_image_files, bboxes, estimations):
+    """
+    Create a JSON string with the location of each template of a batch task.
+
+    :param template_image_files: List of template image paths in the FTP server.
+    :param bboxes: List of bounding boxes (list of latitude, longitude points), one per template.
+    :param estimations: List of homography estimations (inlier count and estimator time) or None, one per template.
+    :return: JSON string.
+    """
+    output_dict = {
+        "locations": [
+            {
+                "template_image_file": template_image_file,
+                "location": bbox if bbox is not None else [],
+                "estimation": estimation
+            }
+            for template_image_file, bbox, estimation in zip(template_image_files, bboxes, estimations)
+        ]
+    }
+
+    return json.dumps(output_dict, separators=(',', ':'))
+
+def process_task(task, db: Database, ftp_config: FtpConfig, feature_cache: FeatureCache, file_cache: LocalFileCache = None,
+                 heartbeat_interval=1.0, heartbeat_jitter=0.2):
+    """
+    Process one task: download the images, run the matching and write the result to the database.
+
+    :param task: AvtTask to process.
+    :param db: Database object.
+    :param ftp_config: Ftp config object data.
+    :param feature_cache: Cache of main image features.
+    :param file_cache: Cache of downloaded files, files are mirrored under the temp directory when None.
+    :param heartbeat_interval: Seconds between updates of the running time in task_stat.
+    :param heartbeat_jitter: Random variation of the heartbeat interval, as a fraction of it.
+    :return: Exit code of the task (EXIT_FINISHED on success).
+    """
+    avt_task_id = task.id
+
+    # update running time in a background thread
+    heartbeat = TaskHeartbeat(db, avt_task_id, interval=heartbeat_interval, jitter=heartbeat_jitter).start()
+
+    def finish(exit_code, task_output=None):
+        # stop the heartbeat and write the final status with the same connection
+        task_stat = 1 if exit_code == EXIT_FINISHED else 0
+        if not heartbeat.finish(task_stat, task_output, exit_code_messages[exit_code]):
+            print(f"Cannot write the final status of task {avt_task_id}")
+        return exit_code
+
+    try:
+        return run_task(task, ftp_config, feature_cache, file_cache, finish)
+    except Exception as e:
+        # Any error after the heartbeat started must end the task, otherwise it keeps reporting a running time
+        print(f"Task {avt_task_id} failed with an unexpected error: {e}")
+        return finish(EXIT_OTHERS_ERROR)
+    finally:
+        # Also stops the beats when the final write itself raised
+        heartbeat.stop()
+
+def run_task(task, ftp_config: FtpConfig, feature_cache: FeatureCache, file_cache: LocalFileCache, finish):
+    """
+    Body of process_task: validate the task parameters, download the images and run the matching.
+
+    :param task: AvtTask to process.
+    :param ftp_config: Ftp config object data.
+    :param feature_cache: Cache of main image features.
+    :param file_cache: Cache of downloaded files.
+    :param finish: Function of process_task writing the exit code and the output of the task.
+    :return: Exit code of the task, as returned by finish.
+    """
+    # Convert JSON string to dictionary
+    if task.task_param is None:
+        print("Input params not valid - No data")
+        return finish(EXIT_INVALID_MODULE_PARAMETERS)
+
+    task_param_dict = json.loads(task.task_param)
+
+    # Access the data as a dictionary
+    main_image_file = task_param_dict.get("main_image_file", "")
+    template_image_file = task_param_dict.get("template_image_file", "")
+    
+    if main_image_file == "" or template_image_file == "" or template_image_file == []:
+        print("Input params not valid")
+        return finish(EXIT_INVALID_MODULE_PARAMETERS)
+    
+    # Detector and matcher of the task, SIFT with a FLANN KD-tree by default
+    feature_backend = get_feature_backend(task_param_dict.get("feature_backend", DEFAULT_FEATURE_BACKEND),
+                                          task_param_dict.get("matcher"))
+    if feature_backend is None:
+        print("Input params not valid - Unknown feature backend")
+        return finish(EXIT_INVALID_MODULE_PARAMETERS)
+    keypoint_budget_method = task_param_dict.get("keypoint_budget_method", "grid")
+    if keypoint_budget_method not in KEYPOINT_BUDGET_METHODS:
+        print(f"Input params not valid - Unknown keypoint budget method '{keypoint_budget_method}'")
+        return finish(EXIT_INVALID_MODULE_PARAMETERS)
+    keypoint_budget = task_param_dict.get("keypoint_budget")
+    keypoint_grid_size = task_param_dict.get("keypoint_grid_size", 16)
+    if (keypoint_budget is not None and not is_int_at_least(keypoint_budget, 1)) or not is_int_at_least(keypoint_grid_size, 1):
+        print(f"Input params not valid - keypoint_budget {keypoint_budget!r}, keypoint_grid_size {keypoint_grid_size!r}")
+        return finish(EXIT_INVALID_MODULE_PARAMETERS)
+    anms_robustness = task_param_dict.get("anms_robustness", 0.9)
+    if not isinstance(anms_robustness, (int, float)) or isinstance(anms_robustness, bool) or not 0 < anms_robustness <= 1:
+        print(f"Input params not valid - anms_robustness {anms_robustness!r}")
+        return finish(EXIT_INVALID_MODULE_PARAMETERS)
+    # Robust estimator of the homography, classic RANSAC by default
+    homography_estimator = get_homography_estimator(task_param_dict.get("homography_estimator", DEFAULT_HOMOGRAPHY_ESTIMATOR),
+                                                    reprojection_threshold=task_param_dict.get("ransac_reprojection_threshold", 5.0),
+                                                    confidence=task_param_dict.get("ransac_confidence", 0.995),
+                                                    max_iters=task_param_dict.get("ransac_max_iters", 2000),
+                                                    affine_precheck=task_param_dict.get("affine_precheck", False))
+    if homography_estimator is None:
+        print("Input params not valid - Unknown homography estimator or invalid estimation settings")
+        return finish(EXIT_INVALID_MODULE_PARAMETERS)
+    # The main image descriptors can be searched in parallel shards
+    match_shards = task_param_dict.get("match_shards", 1)
+    match_workers = task_param_dict.get("match_workers")
+    if not is_int_at_least(match_shards, 1) or (match_workers is not None and not is_int_at_least(match_workers, 1)):
+        print(f"Input params not valid - match_shards {match_shards!r}, match_workers {match_workers!r}")
+        return finish(EXIT_INVALID_MODULE_PARAMETERS)
+    # A larger main image is decimated to fit memory_budget_bytes
+    memory_budget_bytes = task_param_dict.get("memory_budget_bytes")
+    if memory_budget_bytes is not None and not is_int_at_least(memory_budget_bytes, 1):
+        print(f"Input params not valid - memory_budget_bytes {memory_budget_bytes!r}")
+        return finish(EXIT_INVALID_MODULE_PARAMETERS)
+    # The result images are not uploaded, so they are not drawn unless the task asks for a render_mode
+    render_mode = task_param_dict.get("render_mode", "none")
+    preview_max_size = task_param_dict.get("preview_max_size", DEFAULT_PREVIEW_MAX_SIZE)
+    if render_mode not in RENDER_MODES or not is_int_at_least(preview_max_size, 1):
+        print(f"Input params not valid - render_mode {render_mode!r}, preview_max_size {preview_max_size!r}")
+        return finish(EXIT_INVALID_MODULE_PARAMETERS)
+    # Large main images can be read and detected tile by tile, without decoding the whole image
+    extraction_mode = task_param_dict.get("extraction_mode", "full")
+    tile_size = task_param_dict.get("tile_size", 4096)
+    tile_overlap = task_param_dict.get("tile_overlap", 128)
+    if extraction_mode not in EXTRACTION_MODES or not is_int_at_least(tile_size, 1) or not is_int_at_least(tile_overlap, 0):
+        print(f"Input params not valid - extraction_mode '{extraction_mode}', tile_size {tile_size!r}, tile_overlap {tile_overlap!r}")
+        return finish(EXIT_INVALID_MODULE_PARAMETERS)
+
+    # A list of templates is matched against the main image in a single batch
+    is_batch_task = isinstance(template_image_file, list)
+    template_image_files = template_image_file if is_batch_task else [template_image_file]
+
+    # Download the main image and the templates in parallel so templates do not wait behind the main image.
+    # The small templates are kept in memory and decoded from the buffer, without temporary files
+    downloads, download_errors = ftp_download_many(ftp_server=ftp_config.host, ftp_port=ftp_config.port, username=ftp_config.user, password=ftp_config.password,
+                                                   file_paths=[main_image_file] + template_image_files, file_cache=file_cache,
+                                                   segments=ftp_config.download_segments, max_workers=ftp_config.download_workers,
+                                                   in_memory_paths=template_image_files)
+    if download_errors:
+        for file_path, error in download_errors.items():
+            print(f"Cannot download file '{file_path}' from ftp server: {error}")
+        return finish(EXIT_FTP_DOWNLOAD_ERROR)
+
+    downloaded_main_image_file, main_image_checksum = downloads[main_image_file]
+    template_images = [downloads[file_path][0] for file_path in template_image_files]
+    
+    # Options of the matching shared by all modes
+    matching_options = dict(main_image_checksum=main_image_checksum, feature_cache=feature_cache,
+                            memory_budget_bytes=memory_budget_bytes,
+                            render_mode=render_mode, preview_max_size=preview_max_size,
+                            feature_backend=feature_backend,
+                            extraction_mode=extraction_mode, tile_size=tile_size, tile_overlap=tile_overlap,
+                            match_shards=match_shards, match_workers=match_workers,
+                            keypoint_budget=keypoint_budget,
+                            keypoint_budget_method=keypoint_budget_method,
+                            keypoint_grid_size=keypoint_grid_size,
+                            anms_robustness=anms_robustness,
+                            homography_estimator=homography_estimator)
+
+    print("Processing data...")
+    if is_batch_task:
+        batch_results = sift_flann_ransac_matching_batch(downloaded_main_image_file, template_images, **matching_options)
+        output_json_str = create_output_batch_location_json(template_image_files,
+                                                            [latlon for _, _, latlon, _ in batch_results],
+                                                            [estimation for _, _, _, estimation in batch_results])
+        return finish(EXIT_FINISHED, output_json_str)
+
+    template_image = template_images[0]
+    if task_param_dict.get("matching_mode", "full") == "pyramid":
+        result_image, crop, polygon, match_info = pyramid_sift_flann_ransac_matching(downloaded_main_image_file, template_image,
+                                                                                     **matching_options)
+        print(f"Matching path: {match_info['path']}")
+        estimation = match_info.get("estimation")
+    else:
+        result_image, crop, polygon, estimation = sift_flann_ransac_matching(downloaded_main_image_file, template_image,
+                                                                             return_estimation=True, **matching_options)
+    lat_long_bbox = polygon_to_latlon(downloaded_main_image_file, polygon)
+
+    # if crop is not None:
+    #     cv2.imshow("Crop image", crop)
+
+    # show_result_image = cv2.resize(result_image, (1280,720))
+    # cv2.imshow('Sift Template Matching with FLANN RANSAC', show_result_image)
+    # cv2.waitKey(0)
+    # cv2.destroyAllWindows()
+   
+    # # update result to ftp server and update output to database
+    # uploaded_result_image_path, uploaded_result_croped_path = save_and_upload_images(result_image, crop, avt_task_id, ftp_config, FTP_SERVER_OUTPUT_DIR)
+    # if uploaded_result_image_path is None:
+    #     print("Error upload file to FTP server")
+    #     return finish(EXIT_FTP_UPLOAD_ERROR)
         
-    print(f"Running time thread for task {task_id} stopped.")
+    # output_json_str = create_output_json(uploaded_result_image_path, uploaded_result_croped_path, lat_long_bbox)
+    
+    output_json_str = create_output_location_json(lat_long_bbox, estimation)
+    
+    # update finished result to database
+    return finish(EXIT_FINISHED, output_json_str)
+
+def run_daemon(db: Database, ftp_config: FtpConfig, feature_cache: FeatureCache, file_cache: LocalFileCache = None, poll_interval=2.0,
+               heartbeat_interval=1.0, heartbeat_jitter=0.2, max_poll_interval=30.0):
+    """
+    Serve waiting tasks in a loop until SIGINT or SIGTERM is received.
+
+    The database engine, feature cache and loaded libraries are kept between tasks. The exit code of
+    each task is written to its task status instead of ending the process. A task that is running when
+    the signal arrives is finished before shutting down. New tasks are picked up on PostgreSQL NOTIFY
+    when the trigger of Database.install_task_notify_trigger is installed, with polling as fallback.
+
+    :param db: Database object.
+    :param ftp_config: Ftp config object data.
+    :param feature_cache: Cache of main image features.
+    :param file_cache: Cache of downloaded files.
+    :param poll_interval: Seconds to wait before polling again when no task is waiting and none is notified.
+    :param heartbeat_interval: Seconds between running time updates, see process_task.
+    :param heartbeat_jitter: Random variation of the heartbeat interval, see process_task.
+    :param max_poll_interval: Maximum seconds between polls, the interval doubles while no task is found.
+    :return: Exit code of the daemon.
+    """
+    shutdown_event = threading.Event()
+
+    def request_shutdown(signum, frame):
+        print(f"Received signal {signum}, shutting down after the current task...")
+        shutdown_event.set()
+
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+    print(f"Worker daemon started, serving tasks of type {MODULE_SERVE_TASK_TYPE}")
+    while not shutdown_event.is_set():
+        task = db.wait_for_waiting_task(MODULE_SERVE_TASK_TYPE, shutdown_event, poll_interval, max_poll_interval)
+        if task is None:
+            continue
+
+        print(f"Processing task {task.id}")
+        try:
+            # process_task writes the final status of the task, errors included
+            exit_code = process_task(task, db, ftp_config, feature_cache, file_cache, heartbeat_interval, heartbeat_jitter)
+        except Exception as e:
+            print(f"Task {task.id} failed with an unexpected error: {e}")
+            exit_code = EXIT_OTHERS_ERROR
+        print(f"Task {task.id} done: {exit_code_messages[exit_code]}")
+
+    db.close_listeners()
+    close_ftp_pools()
+    print("Worker daemon stopped")
+    return EXIT_FINISHED
 
 if __name__ == "__main__":    
+    # Required by the process pool of the tiled feature extraction in the bundled executable
+    multiprocessing.freeze_support()
     parser = argparse.ArgumentParser(description='SIFT Template Matching with FLANN RANSAC')
     parser.add_argument('--avt_task_id', type=int, default=None,
                         help='Avt task id to process')
     parser.add_argument('--config_file', type=str, default=None,
                         help='Config file for database and ftp server config')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and serve waiting tasks until SIGINT/SIGTERM')
+    parser.add_argument('--poll_interval', type=float, default=2.0,
+                        help='Seconds between polls for waiting tasks in daemon mode when no task is notified')
+    parser.add_argument('--max_poll_interval', type=float, default=30.0,
+                        help='Maximum seconds between polls in daemon mode, the interval doubles while no task is found')
+    parser.add_argument('--install_notify_trigger', action='store_true',
+                        help='Create the database trigger notifying daemons of new waiting tasks, then exit')
 
     args, unknown = parser.parse_known_args()
     avt_task_id = args.avt_task_id
@@ -124,7 +389,7 @@ if __name__ == "__main__":
     print(f"Working with config file: {config_json_path}")
     
     db_config = DatabaseConfig().read_from_json(config_json_path)
-    db = Database(db_config.host, db_config.port, db_config.user, db_config.password, db_config.database)
+    db = Database.from_config(db_config)
     if not db.connected:
         # Let the WTM (Worker Task Manager) know that this module cannot connect to the database
         # (this case can happen when module and WTM run on difference machines)
@@ -133,88 +398,35 @@ if __name__ == "__main__":
         sys.exit(EXIT_CANNOT_CONNECT_TO_DATABASE)
     else:
         print("Succeed connect to the database!")
-    
-    # update running time in thread
-    # just start thread here and skip some process above because it dont take times to excute
-    stop_event = threading.Event()
-    running_time_thread = threading.Thread(target=update_running_time, args=(avt_task_id, db, stop_event))
-    running_time_thread.daemon = True  # Set as daemon so it won't block program exit
-    running_time_thread.start()
+
+    if args.install_notify_trigger:
+        sys.exit(EXIT_FINISHED if db.install_task_notify_trigger() else EXIT_OTHERS_ERROR)
+
+    ftp_config = FtpConfig().read_from_json(config_json_path)
+    feature_cache = FeatureCache.read_from_json(config_json_path)
+    file_cache = LocalFileCache.read_from_json(config_json_path)
+
+    if args.daemon:
+        sys.exit(run_daemon(db, ftp_config, feature_cache, file_cache, args.poll_interval,
+                            db_config.heartbeat_interval, db_config.heartbeat_jitter, args.max_poll_interval))
         
     task = None
     if avt_task_id is None:
-        # try to get task by module type
-        task = db.get_waiting_task_by_type(MODULE_SERVE_TASK_TYPE)
+        # try to claim a task by module type, concurrent workers never get the same task
+        task = db.claim_waiting_task(MODULE_SERVE_TASK_TYPE)
     else:
         task = db.get_task_by_id(avt_task_id)
     
     if task is None:
         print("Cannot get task by ID")
         sys.exit(EXIT_INVALID_INPUT_AVT_TASK_ID)
-    else:
-        avt_task_id = task.id
-
-        
-    # Convert JSON string to dictionary
-    if task.task_param is None:
-        print("Input params not valid - No data")
-        db.update_task(id=avt_task_id, task_stat=0, task_message=exit_code_messages[EXIT_INVALID_MODULE_PARAMETERS])
-        sys.exit(EXIT_INVALID_MODULE_PARAMETERS)
-
-    task_param_dict = json.loads(task.task_param)
-    
 
-    # Access the data as a dictionary
-    main_image_file = task_param_dict.get("main_image_file", "")
-    template_image_file = task_param_dict.get("template_image_file", "")
-    
-    if main_image_file == "" or template_image_file == "":
-        print("Input params not valid")
-        db.update_task(task_id=avt_task_id, task_stat=0, task_message=exit_code_messages[EXIT_INVALID_MODULE_PARAMETERS])
-        sys.exit(EXIT_INVALID_MODULE_PARAMETERS)
-    
-    ftp_config = FtpConfig().read_from_json(config_json_path)
-    downloaded_main_image_file = ftp_download(ftp_server=ftp_config.host, ftp_port=ftp_config.port, username=ftp_config.user, password=ftp_config.password, file_path=main_image_file)
-    downloaded_template_image_file = ftp_download(ftp_server=ftp_config.host, ftp_port=ftp_config.port, username=ftp_config.user, password=ftp_config.password, file_path=template_image_file)
-    
-    if downloaded_main_image_file is None or downloaded_template_image_file is None:
-        print("Cannot download file from ftp server!")
-        db.update_task(task_id=avt_task_id, task_stat=0, task_message=exit_code_messages[EXIT_FTP_DOWNLOAD_ERROR])
-        sys.exit(EXIT_FTP_DOWNLOAD_ERROR)
-    
-    print("Processing data...")
-    result_image, crop, polygon = sift_flann_ransac_matching(downloaded_main_image_file, downloaded_template_image_file)
-    lat_long_bbox = polygon_to_latlon(downloaded_main_image_file, polygon)
-
-    # if crop is not None:
-    #     cv2.imshow("Crop image", crop)
-
-    # show_result_image = cv2.resize(result_image, (1280,720))
-    # cv2.imshow('Sift Template Matching with FLANN RANSAC', show_result_image)
-    # cv2.waitKey(0)
-    # cv2.destroyAllWindows()
-   
-    # # update result to ftp server and update output to database
-    # uploaded_result_image_path, uploaded_result_croped_path = save_and_upload_images(result_image, crop, avt_task_id, ftp_config, FTP_SERVER_OUTPUT_DIR)
-    # if uploaded_result_image_path is None:
-    #     print("Error upload file to FTP server")
-    #     db.update_task(task_id=avt_task_id, task_stat=0, task_message=exit_code_messages[EXIT_FTP_UPLOAD_ERROR])
-    #     sys.exit(EXIT_FTP_UPLOAD_ERROR)
-        
-    # output_json_str = create_output_json(uploaded_result_image_path, uploaded_result_croped_path, lat_long_bbox)
-    
-    output_json_str = create_output_location_json(lat_long_bbox)
-    
-    # stop update thread
-    stop_event.set()
-    running_time_thread.join()
-    
-    # update finished result to database
-    db.update_task(task_id=avt_task_id, task_stat=1, task_output=output_json_str, task_message=exit_code_messages[EXIT_FINISHED])
+    exit_code = process_task(task, db, ftp_config, feature_cache, file_cache,
+                             db_config.heartbeat_interval, db_config.heartbeat_jitter)
     
-    print("Process finished")
-    sys.exit(EXIT_FINISHED)
+    print("Process finished" if exit_code == EXIT_FINISHED else exit_code_messages[exit_code])
+    sys.exit(exit_code)
     
         
     
-# python main.py --avt_task_id 22 2
\ No newline at end of file
+# python main.py --avt_task_id 22 2
@@ -0,0 +1,13 @@
+-- Partial index serving the waiting task lookup of database.py (get_waiting_task_by_type and
+-- claim_waiting_tasks):
+--     WHERE task_stat < 0 AND task_type = :type ORDER BY task_stat DESC, created_at DESC LIMIT n
+-- Only waiting rows are indexed, so the index stays small while finished tasks accumulate.
+--
+-- Apply once per database (CONCURRENTLY does not block workers, and cannot run inside a transaction):
+--     psql -h HOST -p PORT -U USER -d DATABASE -f migrations/001_avt_task_waiting_index.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_avt_task_waiting
+    ON avt_task (task_type, task_stat DESC, created_at DESC)
+    WHERE task_stat < 0;
+
+ANALYZE avt_task;
@@ -1,84 +1,835 @@
 import cv2
 import numpy as np
-from utils import polygon_to_latlon
+from utils import polygon_to_latlon, load_image, load_gray_image, get_image_size
+from feature_cache import keypoints_to_array
+from tiled_extraction import detect_features_tiled
+from feature_backends import get_feature_backend, DEFAULT_FEATURE_BACKEND
+from keypoint_budget import apply_keypoint_budget, keypoint_budget_variant
+from homography_estimators import get_homography_estimator, DEFAULT_HOMOGRAPHY_ESTIMATOR
+from concurrent.futures import ThreadPoolExecutor
+
+# Result images: not drawn, drawn downscaled to a maximum size, or drawn at the loaded main image resolution
+RENDER_MODES = ("none", "preview", "full")
+DEFAULT_PREVIEW_MAX_SIZE = 1280
+
+# Main image feature extraction: whole image at once, or tile by tile from the file
+EXTRACTION_MODES = ("full", "tiled")
+
+# Matches passing the ratio test: template keypoint index, main image keypoint index, descriptor distance
+# and ratio of the distances to the nearest and the second nearest neighbour (lower is more distinctive)
+MATCH_DTYPE = np.dtype([
+    ('query_idx', np.int32),
+    ('train_idx', np.int32),
+    ('distance', np.float32),
+    ('ratio', np.float32),
+])
+
+
+def detect_main_features(extract_features, main_image_checksum=None, feature_cache=None, image_key=None, variant="sift"):
+    """
+    Detect keypoints and descriptors of the main image, reusing the feature cache when possible.
+
+    Parameters:
+    - extract_features (callable): Function without arguments returning (keypoints, descriptors) of the main image.
+    - main_image_checksum (str): MD5 checksum of the main image file, used as cache key (default: None).
+    - feature_cache (FeatureCache): Cache of main image features, disabled when None (default: None).
+    - image_key (str): Stable name of the main image used to detect checksum changes (default: None).
+    - variant (str): Name of the extraction settings, part of the cache key (default: "sift").
+
+    Returns:
+    - keypoints (numpy.ndarray): Structured keypoint array with KEYPOINT_DTYPE fields, memory-mapped on a cache hit.
+    - descriptors (numpy.ndarray): Descriptors of the keypoints.
+    """
+    use_cache = feature_cache is not None and main_image_checksum is not None
+    if use_cache:
+        keypoints, descriptors = feature_cache.load(main_image_checksum, variant=variant, image_key=image_key)
+        if descriptors is not None:
+            print(f"Loaded {len(keypoints)} cached keypoints of the main image.")
+            return keypoints, descriptors
+
+    keypoints, descriptors = extract_features()
+    if not isinstance(keypoints, np.ndarray):
+        keypoints = keypoints_to_array(keypoints)
+    if use_cache:
+        feature_cache.save(main_image_checksum, keypoints, descriptors, variant=variant, image_key=image_key)
+    return keypoints, descriptors
+
+def detect_features(detector, image):
+    """
+    Detect keypoints and compute descriptors, keeping the keypoints as a structured array.
+
+    Returns:
+    - keypoints (numpy.ndarray): Structured keypoint array with KEYPOINT_DTYPE fields.
+    - descriptors (numpy.ndarray): Descriptors of the keypoints, None when no keypoint is found.
+    """
+    keypoints, descriptors = detector.detectAndCompute(image, None)
+    return keypoints_to_array(keypoints), descriptors
+
+def keypoints_to_full_resolution(keypoints, scale, offset=(0, 0)):
+    """
+    Map keypoints detected on a decimated image (or a window of it) to full resolution pixel coordinates.
+
+    Parameters:
+    - keypoints (numpy.ndarray): Structured keypoint array.
+    - scale (tuple): (scale_x, scale_y) from full resolution to the decimated image, see utils.load_gray_image.
+    - offset (tuple): (x, y) position of the window in the decimated image (default: (0, 0)).
+
+    Returns:
+    - keypoints (numpy.ndarray): The keypoints unchanged when there is nothing to map, otherwise a mapped copy.
+    """
+    if tuple(scale) == (1.0, 1.0) and tuple(offset) == (0, 0):
+        return keypoints
+    keypoints = keypoints.copy()
+    # Pixel centers are aligned: center x of the decimated image is at (x + 0.5) / scale - 0.5
+    keypoints['x'] = (keypoints['x'] + offset[0] + 0.5) / scale[0] - 0.5
+    keypoints['y'] = (keypoints['y'] + offset[1] + 0.5) / scale[1] - 0.5
+    keypoints['size'] /= (scale[0] + scale[1]) / 2
+    return keypoints
+
+def feature_variant(name, main_gray, main_scale):
+    """
+    Name of the feature extraction settings in the feature cache, including the size of a decimated main image.
+    """
+    if tuple(main_scale) == (1.0, 1.0):
+        return name
+    return f"{name}_{main_gray.shape[1]}x{main_gray.shape[0]}"
 
 def sift_flann_ransac_matching(main_image_path, template_image_path, lowes_ratio=0.75, min_match_count=5,
-                               flann_index_algorithm=1, flann_trees=5, flann_search_checks=50):
+                               flann_index_algorithm=1, flann_trees=5, flann_search_checks=50,
+                               main_image_checksum=None, feature_cache=None,
+                               extraction_mode="full", tile_size=4096, tile_overlap=128, extraction_workers=None,
+                               memory_budget_bytes=None, render_mode="full", preview_max_size=DEFAULT_PREVIEW_MAX_SIZE,
+                               feature_backend=DEFAULT_FEATURE_BACKEND, match_shards=1, match_workers=None,
+                               keypoint_budget=None, keypoint_budget_method="grid", keypoint_grid_size=16,
+                               anms_robustness=0.9, homography_estimator=DEFAULT_HOMOGRAPHY_ESTIMATOR,
+                               return_estimation=False):
     """
-    Perform SIFT feature matching with FLANN and RANSAC.
+    Perform feature matching with FLANN and RANSAC, with SIFT features by default.
 
     Parameters:
-    - main_image_path (str): Path to the main image.
-    - template_image_path (str): Path to the template image.
+    - main_image_path (str | numpy.ndarray | bytes): Path to the main image, or the image as a decoded array or
+      encoded buffer (see utils.load_image). The "tiled" mode and the feature cache key need a path.
+    - template_image_path (str | numpy.ndarray | bytes): Path to the template image, or the image as a decoded
+      array or encoded buffer, e.g. downloaded with ftp_download_to_memory.
     - lowes_ratio (float): Threshold for Lowe's ratio test to filter good matches (default: 0.75).
     - min_match_count (int): Minimum number of good matches required to proceed with homography (default: 5).
-    - flann_index_algorithm (int): Algorithm to be used for the FLANN index (default: 1).
-    - flann_trees (int): Number of trees in the FLANN index (default: 5).
+    - flann_index_algorithm (int): Algorithm to be used for the FLANN index of float descriptors (default: 1).
+    - flann_trees (int): Number of trees in the FLANN index of float descriptors (default: 5).
     - flann_search_checks (int): Number of checks during FLANN search (default: 50).
+    - main_image_checksum (str): MD5 checksum of the main image, key of the feature cache (default: None).
+    - feature_cache (FeatureCache): Cache of main image features, disabled when None (default: None).
+    - extraction_mode (str): "full" to detect on the whole main image at once, "tiled" to read it in overlapping
+      windows and detect tile by tile in a process pool. The "tiled" mode does not decode the whole main image,
+      see load_render_image (default: "full").
+    - tile_size (int): Tile size in pixels for the "tiled" mode (default: 4096).
+    - tile_overlap (int): Overlap in pixels between tiles for the "tiled" mode (default: 128).
+    - extraction_workers (int): Number of processes for the "tiled" mode, defaults to the number of CPUs.
+    - memory_budget_bytes (int): Budget of the decoded grayscale main image (1 byte per pixel). A larger main
+      image is decimated to fit, see utils.load_gray_image. The "tiled" mode detects at full resolution and only
+      uses the decimated image for drawing. No decimation when None (default: None).
+    - render_mode (str): "none" to skip drawing, "preview" to draw images capped to preview_max_size, or "full"
+      to draw at the loaded main image resolution, see TemplateMatch.render (default: "full").
+    - preview_max_size (int): Largest side in pixels of the "preview" images (default: DEFAULT_PREVIEW_MAX_SIZE).
+    - feature_backend (str | FeatureBackend): Detector and matcher, "sift", "orb", "akaze" or "brisk", see
+      feature_backends.get_feature_backend (default: "sift").
+    - match_shards (int): Number of shards of the main image descriptors searched in parallel, see ShardedIndex.
+      A single index when 1 (default: 1).
+    - match_workers (int): Number of threads searching the shards, defaults to match_shards.
+    - keypoint_budget (int): Maximum number of main image keypoints, selected before caching and indexing,
+      see keypoint_budget.apply_keypoint_budget. All keypoints are kept when None (default: None).
+    - keypoint_budget_method (str): "grid" for the strongest keypoints of every grid cell, or "anms" for
+      adaptive non-maximal suppression (default: "grid").
+    - keypoint_grid_size (int): Number of grid cells along the longest side for the "grid" method (default: 16).
+    - anms_robustness (float): Robustness factor of the "anms" method (default: 0.9).
+    - homography_estimator (str | HomographyEstimator): Robust estimator of the homography with its confidence,
+      iteration and affine pre-check settings, see homography_estimators.get_homography_estimator (default: "ransac").
+    - return_estimation (bool): Also return the estimation details (default: False).
 
     Returns:
-    - result_image (numpy.ndarray): Image with matches drawn.
-    - cropped_result (numpy.ndarray): Cropped region of the main image based on the homography.
-    - polygon (list): List of points (x, y) of the matched region.
+    - result_image (numpy.ndarray): Image with matches drawn, on the grayscale (possibly decimated) main image.
+    - cropped_result (numpy.ndarray): Cropped region of the grayscale (possibly decimated) main image based on the homography.
+    - polygon (list): List of points (x, y) of the matched region, in full resolution pixel coordinates.
+    - estimation (dict): Only with return_estimation, inlier count and estimator time of the homography, see
+      find_template_homography. None when the homography is not estimated.
+    All three are None when an image cannot be read or the backend or the estimator is unknown, the images are
+    None when render_mode is "none".
     """
-    # Load the images
-    main_image = cv2.imread(main_image_path)
-    template_image = cv2.imread(template_image_path)
-    main_gray = cv2.cvtColor(main_image, cv2.COLOR_BGR2GRAY)
+    feature_backend = get_feature_backend(feature_backend)
+    homography_estimator = get_homography_estimator(homography_estimator)
+    if feature_backend is None or homography_estimator is None:
+        return (None, None, None, None) if return_estimation else (None, None, None)
+
+    image_key = main_image_path if isinstance(main_image_path, str) else None
+    if extraction_mode == "tiled" and image_key is None:
+        print("Tiled extraction reads the main image from a file, using full extraction for an in-memory image.")
+        extraction_mode = "full"
+
+    # Load the main image directly as grayscale, the color image is never decoded. The "tiled" mode reads the
+    # features tile by tile, the main image is only decoded when drawing
+    if extraction_mode == "tiled":
+        main_gray, main_scale = load_render_image(main_image_path, render_mode, preview_max_size, memory_budget_bytes)
+        main_readable = get_image_size(main_image_path) is not None and (render_mode == "none" or main_gray is not None)
+    else:
+        main_gray, main_scale = load_gray_image(main_image_path, memory_budget_bytes)
+        main_readable = main_gray is not None
+    template_image = load_image(template_image_path)
+    if not main_readable or template_image is None:
+        print("Cannot read the main image or the template image")
+        return (None, None, None, None) if return_estimation else (None, None, None)
     template_gray = cv2.cvtColor(template_image, cv2.COLOR_BGR2GRAY)
 
-    # Initialize SIFT detector
-    sift = cv2.SIFT_create()
+    # Initialize the feature detector
+    detector = feature_backend.create_detector()
 
     # Detect keypoints and descriptors
-    keypoints_main, descriptors_main = sift.detectAndCompute(main_gray, None)
-    keypoints_template, descriptors_template = sift.detectAndCompute(template_gray, None)
-
-    # Match descriptors using FLANN matcher
-    index_params = dict(algorithm=flann_index_algorithm, trees=flann_trees)
-    search_params = dict(checks=flann_search_checks)
-    flann = cv2.FlannBasedMatcher(index_params, search_params)
-    matches = flann.knnMatch(descriptors_template, descriptors_main, k=2)
-
-    # Apply Lowe's ratio test to find good matches
-    good_matches = []
-    for m, n in matches:
-        if m.distance < lowes_ratio * n.distance:
-            good_matches.append(m)
-
-    cropped_result = None
-    polygon = None
-    if len(good_matches) >= min_match_count:
-        src_pts = np.float32([keypoints_template[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-        dst_pts = np.float32([keypoints_main[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-
-        # Find homography matrix using RANSAC
-        M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-        matches_mask = mask.ravel().tolist()
-
-        h, w = template_image.shape[:2]
-        pts = np.float32([[0, 0], [0, h - 1], [w - 1, h - 1], [w - 1, 0]]).reshape(-1, 1, 2)
-        dst = cv2.perspectiveTransform(pts, M)
-
-        main_image = cv2.polylines(main_image, [np.int32(dst)], True, 255, 3, cv2.LINE_AA)
-
-        # Get the polygon coordinates
-        polygon = np.int32(dst)
-        # Get the bounding box coordinates
-        min_x, min_y = np.int32(dst).min(axis=0).ravel()
-        max_x, max_y = np.int32(dst).max(axis=0).ravel()
-
-        # Crop the result from the main image
-        cropped_result = main_image[min_y:max_y, min_x:max_x]
+    if extraction_mode == "tiled":
+        extract_main = lambda: detect_features_tiled(main_image_path, tile_size, tile_overlap, extraction_workers,
+                                                     feature_backend=feature_backend.name)
+        variant = f"{feature_backend.name}_tiled"
+    else:
+        extract_main = lambda: detect_full_resolution_features(detector, main_gray, main_scale)
+        variant = feature_variant(feature_backend.name, main_gray, main_scale)
+    # The budget is applied before caching, the cached features are those of the budget
+    extract_all = extract_main
+    extract_main = lambda: apply_keypoint_budget(*extract_all(), keypoint_budget, keypoint_budget_method,
+                                                 keypoint_grid_size, anms_robustness)
+    variant += keypoint_budget_variant(keypoint_budget, keypoint_budget_method, keypoint_grid_size, anms_robustness)
+    keypoints_main, descriptors_main = detect_main_features(extract_main, main_image_checksum, feature_cache,
+                                                            image_key=image_key, variant=variant)
+    keypoints_template, descriptors_template = detect_features(detector, template_gray)
+
+    # The main image is the indexed side and the template descriptors are the queries,
+    # so the index can be reused for every template matched against the same main image
+    flann_index = build_match_index(descriptors_main, flann_index_algorithm, flann_trees, flann_search_checks,
+                                    main_image_checksum, feature_cache, variant=variant, feature_backend=feature_backend,
+                                    match_shards=match_shards, match_workers=match_workers)
+    good_matches = match_descriptors(descriptors_template, descriptors_main, lowes_ratio,
+                                     flann_index_algorithm, flann_trees, flann_search_checks, flann_index=flann_index,
+                                     feature_backend=feature_backend)
+    M, matches_mask, estimation = find_template_homography(keypoints_template, keypoints_main, good_matches,
+                                                           min_match_count, homography_estimator)
+
+    match = TemplateMatch(main_gray, main_scale, template_image, keypoints_template, keypoints_main, good_matches, M,
+                          matches_mask, estimation)
+    result_image, cropped_result = match.render(render_mode, preview_max_size)
+    if return_estimation:
+        return result_image, cropped_result, match.polygon, estimation
+    return result_image, cropped_result, match.polygon
+
+def load_render_image(main_image_path, render_mode="full", preview_max_size=DEFAULT_PREVIEW_MAX_SIZE,
+                      memory_budget_bytes=None):
+    """
+    Load the main image of the "tiled" extraction mode, which is only used for drawing: nothing is decoded for
+    render_mode "none", the "preview" mode decodes a decimated image that fits into the preview size.
+
+    Parameters:
+    - main_image_path (str): Path to the main image.
+    - render_mode (str): "none", "preview" or "full", see TemplateMatch.render (default: "full").
+    - preview_max_size (int): Largest side in pixels of the "preview" images (default: DEFAULT_PREVIEW_MAX_SIZE).
+    - memory_budget_bytes (int): Budget of the decoded image, see utils.load_gray_image (default: None).
+
+    Returns:
+    - gray (numpy.ndarray): Grayscale main image, None for "none" or if it cannot be read.
+    - scale (tuple): (scale_x, scale_y) from full resolution to gray, (1.0, 1.0) for "none".
+    """
+    if render_mode == "none":
+        return None, (1.0, 1.0)
+    if render_mode == "preview":
+        # The largest side of the preview fits into preview_max_size, so does its area into a square of that size
+        preview_budget = preview_max_size * preview_max_size
+        memory_budget_bytes = min(memory_budget_bytes, preview_budget) if memory_budget_bytes else preview_budget
+    return load_gray_image(main_image_path, memory_budget_bytes)
 
+def detect_full_resolution_features(detector, gray, scale):
+    """
+    Detect features on a possibly decimated image and return keypoints in full resolution coordinates.
+
+    Returns:
+    - keypoints (numpy.ndarray): Structured keypoint array in full resolution coordinates.
+    - descriptors (numpy.ndarray): Descriptors of the keypoints.
+    """
+    keypoints, descriptors = detect_features(detector, gray)
+    return keypoints_to_full_resolution(keypoints, scale), descriptors
+
+def build_flann_index(descriptors_main, flann_index_algorithm=1, flann_trees=5, flann_search_checks=50,
+                      main_image_checksum=None, feature_cache=None, variant="sift", feature_backend=DEFAULT_FEATURE_BACKEND,
+                      index_key_suffix=""):
+    """
+    Build a FLANN index over the main image descriptors, or load it from the feature cache.
+
+    The FLANN settings (and index_key_suffix, e.g. the shard of the descriptors) are part of the cache key,
+    so an index is only reused with the same settings.
+    The descriptors must stay alive as long as the returned index is used. Float descriptors get a
+    KD-tree index, binary descriptors an LSH index (see FeatureBackend.index_params) that is never cached.
+
+    Returns:
+    - flann_index (cv2.flann_Index): Index over descriptors_main, or None if there are too few descriptors
+      to match or the backend matches by brute force.
+    """
+    feature_backend = get_feature_backend(feature_backend)
+    if descriptors_main is None or len(descriptors_main) < 2 or feature_backend.matcher == "bruteforce":
+        return None
+    use_cache = feature_cache is not None and main_image_checksum is not None and feature_backend.index_cacheable
+    index_key = feature_backend.index_key(flann_index_algorithm, flann_trees, flann_search_checks) + index_key_suffix
+    if use_cache:
+        flann_index = feature_cache.load_flann_index(main_image_checksum, descriptors_main, index_key, variant=variant)
+        if flann_index is not None:
+            print("Loaded cached FLANN index of the main image.")
+            return flann_index
+
+    index_params = feature_backend.index_params(flann_index_algorithm, flann_trees)
+    flann_index = cv2.flann_Index(descriptors_main, index_params)
+    if use_cache:
+        feature_cache.save_flann_index(main_image_checksum, flann_index, index_key, variant=variant)
+    return flann_index
+
+def knn_search(descriptors_template, descriptors_main, flann_index, feature_backend, flann_search_checks=50):
+    """
+    Find the 2 nearest main image descriptors of every template descriptor.
+
+    Parameters:
+    - flann_index (cv2.flann_Index): Index over descriptors_main, unused when the backend matches by brute force.
+    - feature_backend (FeatureBackend): Backend the descriptors were computed with.
+
+    Returns:
+    - distances (numpy.ndarray): float32 array of shape (n, 2), squared for the FLANN KD-tree (see FeatureBackend.squared_distances).
+    - indices (numpy.ndarray): int32 array of shape (n, 2), -1 for a neighbour missing from the probed LSH buckets.
+    """
+    if feature_backend.matcher == "bruteforce":
+        # Same 2 nearest neighbours as cv2.BFMatcher.knnMatch, returned as arrays instead of cv2.DMatch objects
+        distances, indices = cv2.batchDistance(descriptors_template, np.asarray(descriptors_main), -1,
+                                               normType=feature_backend.norm_type, K=2)
+    else:
+        indices, distances = flann_index.knnSearch(descriptors_template, 2, params=dict(checks=flann_search_checks))
+    return distances.astype(np.float32), indices.astype(np.int32)
+
+class ShardedIndex():
+    """
+    Nearest neighbour search over the main image descriptors split into contiguous shards, each with its own
+    FLANN index (or brute force search).
+
+    The shards are searched concurrently in a thread pool, OpenCV releases the GIL during the search, and the
+    per-shard 2 nearest neighbours are merged into the global 2 nearest neighbours before the ratio test.
+    Each of the global 2 nearest neighbours is among the 2 nearest neighbours of its own shard, so with
+    brute force per shard the merged result is exactly the result of a single brute force search.
+    """
+    def __init__(self, descriptors_main, shards, feature_backend=DEFAULT_FEATURE_BACKEND, flann_index_algorithm=1,
+                 flann_trees=5, flann_search_checks=50, main_image_checksum=None, feature_cache=None, variant="sift",
+                 max_workers=None):
+        """
+        :param descriptors_main: Main image descriptors, at least 2. They must stay alive while the index is used.
+        :param shards: Number of shards, reduced so that every shard holds at least 2 descriptors.
+        :param feature_backend: Backend the descriptors were computed with.
+        :param flann_index_algorithm, flann_trees, flann_search_checks: FLANN settings of every shard.
+        :param main_image_checksum, feature_cache, variant: Feature cache of the shard indexes, see build_flann_index.
+        :param max_workers: Number of threads searching the shards, defaults to the number of shards.
+        """
+        self.feature_backend = get_feature_backend(feature_backend)
+        self.flann_search_checks = flann_search_checks
+        shards = max(1, min(shards, len(descriptors_main) // 2))
+        self.max_workers = max_workers or shards
+        bounds = np.linspace(0, len(descriptors_main), shards + 1).astype(int)
+        self.offsets = bounds[:-1]
+        # Contiguous slices are views, memory-mapped cached descriptors are not copied
+        self.descriptors = [descriptors_main[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        self.indexes = [build_flann_index(descriptors, flann_index_algorithm, flann_trees, flann_search_checks,
+                                          main_image_checksum, feature_cache, variant=variant,
+                                          feature_backend=self.feature_backend, index_key_suffix=f"_s{i}of{shards}")
+                        for i, descriptors in enumerate(self.descriptors)]
+
+    def knn_search(self, descriptors_template):
+        """
+        Find the global 2 nearest main image descriptors of every template descriptor, see knn_search.
+        """
+        def search_shard(shard):
+            distances, indices = knn_search(descriptors_template, self.descriptors[shard], self.indexes[shard],
+                                            self.feature_backend, self.flann_search_checks)
+            missing = indices < 0
+            distances[missing] = np.inf
+            return distances, np.where(missing, -1, indices + self.offsets[shard])
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(search_shard, range(len(self.descriptors))))
+
+        distances = np.hstack([shard_distances for shard_distances, _ in results])
+        indices = np.hstack([shard_indices for _, shard_indices in results])
+        # A stable sort keeps the lowest index first among equal distances, as a single search over all descriptors
+        nearest = np.argsort(distances, axis=1, kind='stable')[:, :2]
+        return np.take_along_axis(distances, nearest, axis=1), np.take_along_axis(indices, nearest, axis=1)
+
+def build_match_index(descriptors_main, flann_index_algorithm=1, flann_trees=5, flann_search_checks=50,
+                      main_image_checksum=None, feature_cache=None, variant="sift", feature_backend=DEFAULT_FEATURE_BACKEND,
+                      match_shards=1, match_workers=None):
+    """
+    Build the index matched against by match_descriptors: a single FLANN index (see build_flann_index), or a
+    ShardedIndex when match_shards is larger than 1.
+
+    Returns:
+    - flann_index (cv2.flann_Index | ShardedIndex): Index over descriptors_main, or None if there are too few
+      descriptors to match or a single brute force search is used.
+    """
+    if match_shards > 1 and descriptors_main is not None and len(descriptors_main) >= 4:
+        return ShardedIndex(descriptors_main, match_shards, feature_backend, flann_index_algorithm, flann_trees,
+                            flann_search_checks, main_image_checksum, feature_cache, variant, match_workers)
+    return build_flann_index(descriptors_main, flann_index_algorithm, flann_trees, flann_search_checks,
+                             main_image_checksum, feature_cache, variant=variant, feature_backend=feature_backend)
+
+def match_descriptors(descriptors_template, descriptors_main, lowes_ratio=0.75,
+                      flann_index_algorithm=1, flann_trees=5, flann_search_checks=50, flann_index=None,
+                      feature_backend=DEFAULT_FEATURE_BACKEND):
+    """
+    Match template descriptors against main image descriptors with FLANN (or brute force) and Lowe's ratio test.
+
+    Parameters:
+    - flann_index (cv2.flann_Index | ShardedIndex): Prebuilt index over descriptors_main, see build_match_index.
+      A single index is built on the fly when None (default: None).
+    - feature_backend (str | FeatureBackend): Backend the descriptors were computed with (default: "sift").
+
+    Returns:
+    - good_matches (numpy.ndarray): Matches passing the ratio test, structured array with MATCH_DTYPE fields.
+    """
+    if descriptors_template is None or descriptors_main is None or len(descriptors_main) < 2:
+        return np.empty(0, dtype=MATCH_DTYPE)
+
+    feature_backend = get_feature_backend(feature_backend)
+    if isinstance(flann_index, ShardedIndex):
+        distances, indices = flann_index.knn_search(descriptors_template)
     else:
-        matches_mask = None
+        if flann_index is None and feature_backend.matcher != "bruteforce":
+            flann_index = build_flann_index(descriptors_main, flann_index_algorithm, flann_trees, flann_search_checks,
+                                            feature_backend=feature_backend)
+        distances, indices = knn_search(descriptors_template, descriptors_main, flann_index, feature_backend, flann_search_checks)
+
+    # Apply Lowe's ratio test to find good matches, the FLANN KD-tree returns squared L2 distances so
+    # the ratio is squared as well. An LSH index returns -1 for neighbours missing from the probed buckets
+    squared = feature_backend.squared_distances
+    ratio = lowes_ratio ** 2 if squared else lowes_ratio
+    passed = (indices[:, 0] >= 0) & (distances[:, 0] < ratio * distances[:, 1])
+
+    good_matches = np.empty(np.count_nonzero(passed), dtype=MATCH_DTYPE)
+    good_matches['query_idx'] = np.flatnonzero(passed)
+    good_matches['train_idx'] = indices[passed, 0]
+    good_matches['distance'] = np.sqrt(distances[passed, 0]) if squared else distances[passed, 0]
+    ratios = distances[passed, 0] / distances[passed, 1]
+    good_matches['ratio'] = np.sqrt(ratios) if squared else ratios
+    return good_matches
+
+def matched_points(keypoints, indices):
+    """
+    Gather the (x, y) positions of keypoints.
+
+    Parameters:
+    - keypoints (numpy.ndarray): Structured keypoint array.
+    - indices (numpy.ndarray): Indices of the keypoints to gather.
+
+    Returns:
+    - points (numpy.ndarray): float32 array of shape (len(indices), 2).
+    """
+    selected = keypoints[indices]
+    return np.stack((selected['x'], selected['y']), axis=-1).astype(np.float32)
+
+def find_template_homography(keypoints_template, keypoints_main, good_matches, min_match_count=5,
+                             homography_estimator=DEFAULT_HOMOGRAPHY_ESTIMATOR):
+    """
+    Estimate the homography from the template to the main image, with RANSAC by default.
+
+    Parameters:
+    - keypoints_template (numpy.ndarray): Structured keypoint array of the template.
+    - keypoints_main (numpy.ndarray): Structured keypoint array of the main image.
+    - good_matches (numpy.ndarray): Matches with MATCH_DTYPE fields, see match_descriptors.
+    - homography_estimator (str | HomographyEstimator): Robust estimator, "ransac", "magsac", "prosac" or
+      "accurate", see homography_estimators.get_homography_estimator (default: "ransac").
+
+    Returns:
+    - M (numpy.ndarray): 3x3 homography matrix, or None if there are not enough matches or no homography is found.
+    - matches_mask (numpy.ndarray): Boolean inlier mask of good_matches, or None without homography.
+    - estimation (dict): "estimator", "matches", "inliers", "estimator_time" in seconds, and "reason" without
+      homography, see HomographyEstimator.estimate.
+    """
+    homography_estimator = get_homography_estimator(homography_estimator)
+    if len(good_matches) < min_match_count:
+        return None, None, {"estimator": homography_estimator.name, "matches": len(good_matches), "inliers": 0,
+                            "estimator_time": 0.0, "reason": "not enough matches"}
+
+    src_pts = matched_points(keypoints_template, good_matches['query_idx']).reshape(-1, 1, 2)
+    dst_pts = matched_points(keypoints_main, good_matches['train_idx']).reshape(-1, 1, 2)
+
+    # PROSAC samples the most distinctive matches first
+    M, mask, estimation = homography_estimator.estimate(src_pts, dst_pts, scores=good_matches['ratio'])
+    print(f"Homography ({estimation['estimator']}): {estimation['inliers']} inliers of {estimation['matches']} matches "
+          f"in {estimation['estimator_time'] * 1000:.1f} ms" + (f", {estimation['reason']}" if M is None else ""))
+    return M, mask, estimation
+
+def to_image_coordinates(points, scale):
+    """
+    Map full resolution pixel coordinates to a decimated image, see utils.load_gray_image.
+
+    Returns:
+    - points (numpy.ndarray): int32 points in the decimated image, same shape as the input.
+    """
+    if tuple(scale) == (1.0, 1.0):
+        return np.int32(points)
+    return np.int32(np.round((np.asarray(points, dtype=np.float64) + 0.5) * scale - 0.5))
+
+def preview_scale(shape, max_size):
+    """
+    Downscaling factor so that the largest side of an image of `shape` fits into max_size pixels, at most 1.
+    """
+    largest_side = max(shape[:2])
+    if max_size is None or largest_side <= max_size:
+        return 1.0
+    return max_size / largest_side
+
+def crop_matched_region(main_image, polygon, main_scale=(1.0, 1.0), max_size=None):
+    """
+    Crop the bounding box of the matched region from the main image and draw the region on the copy.
+    The main image is not modified.
+
+    Parameters:
+    - main_image (numpy.ndarray): Main image, possibly decimated.
+    - polygon (numpy.ndarray): Matched region in full resolution coordinates, see project_template_polygon.
+    - main_scale (tuple): (scale_x, scale_y) of main_image relative to full resolution (default: (1.0, 1.0)).
+    - max_size (int): Largest side of the returned crop, downscaled to fit when larger. Not capped when None (default: None).
+
+    Returns:
+    - cropped_result (numpy.ndarray): Cropped region of the main image.
+    """
+    drawn_polygon = to_image_coordinates(polygon, main_scale)
+    min_x, min_y = np.maximum(drawn_polygon.min(axis=0).ravel(), 0)
+    max_x, max_y = drawn_polygon.max(axis=0).ravel()
+    cropped_result = main_image[min_y:max_y, min_x:max_x].copy()
+    drawn_polygon = drawn_polygon - [min_x, min_y]
+    scale = preview_scale(cropped_result.shape, max_size) if cropped_result.size else 1.0
+    if scale < 1.0:
+        cropped_result = cv2.resize(cropped_result, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        drawn_polygon = to_image_coordinates(drawn_polygon, (scale, scale))
+    cv2.polylines(cropped_result, [drawn_polygon], True, 255, 3, cv2.LINE_AA)
+    return cropped_result
+
+def draw_matches(main_image, template_image, keypoints_template, keypoints_main, good_matches, matches_mask,
+                 polygon=None, main_scale=(1.0, 1.0), template_scale=(1.0, 1.0)):
+    """
+    Draw the template and the main image side by side with the matches and the matched region.
+    cv2.KeyPoint and cv2.DMatch objects are only created here, for the matched keypoints, in drawn image coordinates.
+
+    Parameters:
+    - main_image (numpy.ndarray): Main image to draw, possibly decimated. It is not modified.
+    - template_image (numpy.ndarray): Template image to draw, possibly downscaled.
+    - keypoints_template (numpy.ndarray): Structured keypoint array of the template, in full resolution template coordinates.
+    - keypoints_main (numpy.ndarray): Structured keypoint array of the main image, in full resolution coordinates.
+    - good_matches (numpy.ndarray): Matches with MATCH_DTYPE fields between keypoints_template and keypoints_main.
+    - matches_mask (numpy.ndarray): Boolean inlier mask of good_matches, all matches are drawn when None.
+    - polygon (numpy.ndarray): Matched region in full resolution coordinates, not drawn when None (default: None).
+    - main_scale (tuple): (scale_x, scale_y) of main_image relative to full resolution (default: (1.0, 1.0)).
+    - template_scale (tuple): (scale_x, scale_y) of template_image relative to full resolution (default: (1.0, 1.0)).
+
+    Returns:
+    - result_image (numpy.ndarray): Image with matches drawn.
+    """
+    template_points = matched_points(keypoints_template, good_matches['query_idx'])
+    main_points = matched_points(keypoints_main, good_matches['train_idx'])
+    drawn_template_keypoints = [cv2.KeyPoint(float(x), float(y), 1) for x, y in to_image_coordinates(template_points, template_scale)]
+    drawn_main_keypoints = [cv2.KeyPoint(float(x), float(y), 1) for x, y in to_image_coordinates(main_points, main_scale)]
+    drawn_matches = [cv2.DMatch(i, i, float(distance)) for i, distance in enumerate(good_matches['distance'])]
+    if matches_mask is not None:
+        matches_mask = matches_mask.astype(np.uint8).tolist()
 
-    # Draw matches
     draw_params = dict(matchColor=(0, 255, 0), singlePointColor=None, matchesMask=matches_mask, flags=2)
-    result_image = cv2.drawMatches(template_image, keypoints_template, main_image, keypoints_main, good_matches, None, **draw_params)
+    result_image = cv2.drawMatches(template_image, drawn_template_keypoints, main_image, drawn_main_keypoints,
+                                   drawn_matches, None, **draw_params)
+    if polygon is not None:
+        # The main image is drawn right of the template
+        drawn_polygon = to_image_coordinates(polygon, main_scale)
+        cv2.polylines(result_image, [drawn_polygon + [template_image.shape[1], 0]], True, 255, 3, cv2.LINE_AA)
+    return result_image
+
+class TemplateMatch():
+    """
+    Outcome of matching one template against a main image.
+
+    Keeps the keypoints, the good matches and the RANSAC inlier mask, so that the result images are only
+    drawn when render() is called. Location-only callers never allocate the side-by-side match image.
+    """
+    def __init__(self, main_image, main_scale, template_image, keypoints_template, keypoints_main,
+                 good_matches, M, matches_mask, estimation=None):
+        """
+        :param main_image: Grayscale main image, possibly decimated, or None when nothing is drawn.
+        :param main_scale: (scale_x, scale_y) of main_image relative to full resolution.
+        :param template_image: Template image.
+        :param keypoints_template: Structured keypoint array of the template.
+        :param keypoints_main: Structured keypoint array of the main image in full resolution coordinates.
+        :param good_matches: Matches passing the ratio test, with MATCH_DTYPE fields.
+        :param M: Homography from the template to full resolution main image coordinates, None if not found.
+        :param matches_mask: Boolean RANSAC inlier mask of good_matches, None if not found.
+        :param estimation: Inlier count and estimator time of the homography, see find_template_homography.
+        """
+        self.main_image = main_image
+        self.main_scale = main_scale
+        self.template_image = template_image
+        self.keypoints_template = keypoints_template
+        self.keypoints_main = keypoints_main
+        self.good_matches = good_matches
+        self.M = M
+        self.matches_mask = matches_mask
+        self.estimation = estimation
+        self.polygon = project_template_polygon(template_image.shape, M) if M is not None else None
+
+    def render_crop(self, render_mode="full", preview_max_size=DEFAULT_PREVIEW_MAX_SIZE):
+        """
+        Draw the cropped matched region.
+
+        :param render_mode: "none", "preview" (largest side capped to preview_max_size) or "full".
+        :param preview_max_size: Largest side in pixels of the "preview" images.
+        :return: Cropped region of the main image, None for "none" or when the template is not found.
+        """
+        if render_mode == "none" or self.polygon is None:
+            return None
+        max_size = preview_max_size if render_mode == "preview" else None
+        return crop_matched_region(self.main_image, self.polygon, self.main_scale, max_size)
+
+    def render(self, render_mode="full", preview_max_size=DEFAULT_PREVIEW_MAX_SIZE):
+        """
+        Draw the result images. "full" draws on the main image at its loaded resolution, "preview" on the main
+        image and the template downscaled so that their largest sides fit into preview_max_size.
+
+        :param render_mode: "none", "preview" or "full".
+        :param preview_max_size: Largest side in pixels of the "preview" images.
+        :return: (result_image, cropped_result), both None for "none".
+        """
+        if render_mode not in RENDER_MODES:
+            print(f"Unknown render mode '{render_mode}', expected one of {RENDER_MODES}. Rendering nothing.")
+            return None, None
+        if render_mode == "none":
+            return None, None
+
+        main_image, main_scale = self.main_image, self.main_scale
+        template_image, template_scale = self.template_image, (1.0, 1.0)
+        if render_mode == "preview":
+            main_image, main_scale = downscale_for_preview(main_image, main_scale, preview_max_size)
+            template_image, template_scale = downscale_for_preview(template_image, template_scale, preview_max_size)
+        result_image = draw_matches(main_image, template_image, self.keypoints_template, self.keypoints_main,
+                                    self.good_matches, self.matches_mask, self.polygon, main_scale, template_scale)
+        return result_image, self.render_crop(render_mode, preview_max_size)
+
+def downscale_for_preview(image, scale, max_size):
+    """
+    Downscale an image so that its largest side fits into max_size pixels.
+
+    Returns:
+    - image (numpy.ndarray): The downscaled image, or the input image when it already fits.
+    - scale (tuple): (scale_x, scale_y) of the returned image relative to full resolution.
+    """
+    factor = preview_scale(image.shape, max_size)
+    if factor == 1.0:
+        return image, scale
+    h, w = image.shape[:2]
+    preview = cv2.resize(image, (max(1, round(w * factor)), max(1, round(h * factor))), interpolation=cv2.INTER_AREA)
+    return preview, (scale[0] * preview.shape[1] / w, scale[1] * preview.shape[0] / h)
+
+def sift_flann_ransac_matching_batch(main_image_path, template_image_paths, lowes_ratio=0.75, min_match_count=5,
+                                     flann_index_algorithm=1, flann_trees=5, flann_search_checks=50,
+                                     main_image_checksum=None, feature_cache=None,
+                                     extraction_mode="full", tile_size=4096, tile_overlap=128, extraction_workers=None,
+                                     max_workers=None, memory_budget_bytes=None, render_mode="full",
+                                     preview_max_size=DEFAULT_PREVIEW_MAX_SIZE, feature_backend=DEFAULT_FEATURE_BACKEND,
+                                     match_shards=1, match_workers=None, keypoint_budget=None,
+                                     keypoint_budget_method="grid", keypoint_grid_size=16, anms_robustness=0.9,
+                                     homography_estimator=DEFAULT_HOMOGRAPHY_ESTIMATOR):
+    """
+    Match many templates against one main image. The main image is loaded, its features extracted and
+    indexed once, then the templates are detected and matched concurrently in a thread pool.
+
+    Parameters:
+    - main_image_path (str | numpy.ndarray | bytes): Path to the main image, or the image itself (see sift_flann_ransac_matching).
+      latlon_polygon is only computed for a georeferenced main image file.
+    - template_image_paths (list): Paths to the template images, or the images as decoded arrays or encoded buffers.
+    - max_workers (int): Number of threads matching templates, defaults to the ThreadPoolExecutor default.
+    - render_mode (str): "none" skips the crops, "preview" caps their largest side to preview_max_size (default: "full").
+    - Other parameters: See sift_flann_ransac_matching.
+
+    Returns:
+    - results (list): One (cropped_result, polygon, latlon_polygon, estimation) tuple per template, in the input order.
+      cropped_result and polygon are None and latlon_polygon is empty when the template is not found,
+      estimation has the inlier count and estimator time of the homography (see find_template_homography),
+      None when the template or the main image cannot be read,
+      cropped_result is also None when render_mode is "none".
+      polygon is in full resolution pixel coordinates, cropped_result is cut from the grayscale (possibly decimated) main image.
+    """
+    feature_backend = get_feature_backend(feature_backend)
+    homography_estimator = get_homography_estimator(homography_estimator)
+    if feature_backend is None or homography_estimator is None:
+        return [(None, None, [], None) for _ in template_image_paths]
+
+    image_key = main_image_path if isinstance(main_image_path, str) else None
+    tiled = extraction_mode == "tiled" and image_key is not None
+    if tiled:
+        # The features are read tile by tile, the main image is only decoded for the crops
+        main_gray, main_scale = load_render_image(main_image_path, render_mode, preview_max_size, memory_budget_bytes)
+        main_readable = get_image_size(main_image_path) is not None and (render_mode == "none" or main_gray is not None)
+    else:
+        main_gray, main_scale = load_gray_image(main_image_path, memory_budget_bytes)
+        main_readable = main_gray is not None
+    if not main_readable:
+        print("Cannot read the main image")
+        return [(None, None, [], None) for _ in template_image_paths]
+
+    if tiled:
+        extract_main = lambda: detect_features_tiled(main_image_path, tile_size, tile_overlap, extraction_workers,
+                                                     feature_backend=feature_backend.name)
+        variant = f"{feature_backend.name}_tiled"
+    else:
+        extract_main = lambda: detect_full_resolution_features(feature_backend.create_detector(), main_gray, main_scale)
+        variant = feature_variant(feature_backend.name, main_gray, main_scale)
+    # The budget is applied before caching, the cached features are those of the budget
+    extract_all = extract_main
+    extract_main = lambda: apply_keypoint_budget(*extract_all(), keypoint_budget, keypoint_budget_method,
+                                                 keypoint_grid_size, anms_robustness)
+    variant += keypoint_budget_variant(keypoint_budget, keypoint_budget_method, keypoint_grid_size, anms_robustness)
+    keypoints_main, descriptors_main = detect_main_features(extract_main, main_image_checksum, feature_cache,
+                                                            image_key=image_key, variant=variant)
+    flann_index = build_match_index(descriptors_main, flann_index_algorithm, flann_trees, flann_search_checks,
+                                    main_image_checksum, feature_cache, variant=variant, feature_backend=feature_backend,
+                                    match_shards=match_shards, match_workers=match_workers)
+
+    def match_template(template_image_path):
+        template_image = load_image(template_image_path)
+        if template_image is None:
+            print(f"Cannot read template image '{template_image_path if isinstance(template_image_path, str) else '<in memory>'}'")
+            return None, None, [], None
+        template_gray = cv2.cvtColor(template_image, cv2.COLOR_BGR2GRAY)
+        # Detectors are not shared between threads
+        keypoints_template, descriptors_template = detect_features(feature_backend.create_detector(), template_gray)
+
+        good_matches = match_descriptors(descriptors_template, descriptors_main, lowes_ratio,
+                                         flann_index_algorithm, flann_trees, flann_search_checks, flann_index=flann_index,
+                                         feature_backend=feature_backend)
+        M, matches_mask, estimation = find_template_homography(keypoints_template, keypoints_main, good_matches,
+                                                               min_match_count, homography_estimator)
+        if M is None:
+            return None, None, [], estimation
+
+        # The crop is drawn on a copy, the main image is shared between threads
+        match = TemplateMatch(main_gray, main_scale, template_image, keypoints_template, keypoints_main,
+                              good_matches, M, matches_mask, estimation)
+        cropped_result = match.render_crop(render_mode, preview_max_size)
+        return cropped_result, match.polygon, polygon_to_latlon(main_image_path, match.polygon), estimation
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(match_template, template_image_paths))
+
+def project_template_polygon(template_shape, M):
+    """
+    Project the template corners into the main image.
+
+    Returns:
+    - polygon (numpy.ndarray): int32 array of shape (4, 1, 2) with the (x, y) corners of the matched region.
+    """
+    h, w = template_shape[:2]
+    pts = np.float32([[0, 0], [0, h - 1], [w - 1, h - 1], [w - 1, 0]]).reshape(-1, 1, 2)
+    return np.int32(cv2.perspectiveTransform(pts, M))
+
+def pyramid_sift_flann_ransac_matching(main_image_path, template_image_path, coarse_scale=0.25, window_padding=0.5,
+                                       lowes_ratio=0.75, min_match_count=5, flann_index_algorithm=1, flann_trees=5,
+                                       flann_search_checks=50, memory_budget_bytes=None, render_mode="full",
+                                       preview_max_size=DEFAULT_PREVIEW_MAX_SIZE, feature_backend=DEFAULT_FEATURE_BACKEND,
+                                       homography_estimator=DEFAULT_HOMOGRAPHY_ESTIMATOR, **full_search_kwargs):
+    """
+    Perform coarse-to-fine feature matching: locate the template on a downsampled main image first, then
+    detect and match again at full resolution only inside a padded window around the coarse polygon.
+    With a memory budget, "full resolution" is the resolution of the decimated main image, see utils.load_gray_image.
+    Falls back to a full search with sift_flann_ransac_matching when either stage fails.
+
+    Parameters:
+    - main_image_path (str | numpy.ndarray | bytes): Path to the main image, or the image itself (see sift_flann_ransac_matching).
+    - template_image_path (str | numpy.ndarray | bytes): Path to the template image, or the image itself.
+    - coarse_scale (float): Downsampling factor of the main image for the coarse pass (default: 0.25).
+    - window_padding (float): Padding around the coarse bounding box, relative to its size (default: 0.5).
+    - lowes_ratio, min_match_count, flann_index_algorithm, flann_trees, flann_search_checks, memory_budget_bytes,
+      render_mode, preview_max_size, feature_backend, homography_estimator: See sift_flann_ransac_matching.
+    - full_search_kwargs: Extra arguments passed to sift_flann_ransac_matching on fallback (e.g. feature_cache).
+
+    Returns:
+    - result_image (numpy.ndarray): Image with matches drawn.
+    - cropped_result (numpy.ndarray): Cropped region of the main image based on the homography.
+    - polygon (list): List of points (x, y) of the matched region, in full resolution pixel coordinates.
+    - info (dict): "path" is "coarse_to_fine", "full_search", or "none" when an image cannot be read;
+      "reason" explains a fallback, "window" is the searched window [x0, y0, x1, y1] in full resolution coordinates,
+      "estimation" has the inlier count and estimator time of the final homography (see find_template_homography).
+    """
+    feature_backend = get_feature_backend(feature_backend)
+    if feature_backend is None:
+        return None, None, None, {"path": "none", "reason": "unknown feature backend"}
+    homography_estimator = get_homography_estimator(homography_estimator)
+    if homography_estimator is None:
+        return None, None, None, {"path": "none", "reason": "unknown homography estimator"}
+    match_params = dict(lowes_ratio=lowes_ratio, flann_index_algorithm=flann_index_algorithm,
+                        flann_trees=flann_trees, flann_search_checks=flann_search_checks, feature_backend=feature_backend)
+
+    def full_search(reason):
+        print(f"Coarse-to-fine matching failed ({reason}), falling back to full search.")
+        *result, estimation = sift_flann_ransac_matching(main_image_path, template_image_path,
+                                                         min_match_count=min_match_count,
+                                                         memory_budget_bytes=memory_budget_bytes, render_mode=render_mode,
+                                                         preview_max_size=preview_max_size,
+                                                         homography_estimator=homography_estimator,
+                                                         return_estimation=True, **match_params, **full_search_kwargs)
+        return (*result, {"path": "full_search", "reason": reason, "estimation": estimation})
+
+    # Load the images, the main image directly as grayscale
+    main_gray, main_scale = load_gray_image(main_image_path, memory_budget_bytes)
+    template_image = load_image(template_image_path)
+    if main_gray is None or template_image is None:
+        print("Cannot read the main image or the template image")
+        return None, None, None, {"path": "none", "reason": "cannot read images"}
+    template_gray = cv2.cvtColor(template_image, cv2.COLOR_BGR2GRAY)
+    main_h, main_w = main_gray.shape[:2]
+
+    detector = feature_backend.create_detector()
+    keypoints_template, descriptors_template = detect_features(detector, template_gray)
+
+    # Coarse pass on the downsampled main image
+    coarse_gray = cv2.resize(main_gray, None, fx=coarse_scale, fy=coarse_scale, interpolation=cv2.INTER_AREA)
+    keypoints_coarse, descriptors_coarse = detect_features(detector, coarse_gray)
+    good_matches = match_descriptors(descriptors_template, descriptors_coarse, **match_params)
+    M_coarse, _, _ = find_template_homography(keypoints_template, keypoints_coarse, good_matches, min_match_count,
+                                              homography_estimator)
+    if M_coarse is None:
+        return full_search("no coarse homography")
+
+    # Candidate polygon in main_gray coordinates
+    h, w = template_gray.shape[:2]
+    pts = np.float32([[0, 0], [0, h - 1], [w - 1, h - 1], [w - 1, 0]]).reshape(-1, 1, 2)
+    candidate = cv2.perspectiveTransform(pts, M_coarse).reshape(-1, 2) / coarse_scale
+    min_x, min_y = candidate.min(axis=0)
+    max_x, max_y = candidate.max(axis=0)
+    pad = window_padding * max(max_x - min_x, max_y - min_y)
+    x0, y0 = int(max(min_x - pad, 0)), int(max(min_y - pad, 0))
+    x1, y1 = int(min(max_x + pad, main_w)), int(min(max_y + pad, main_h))
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return full_search("coarse polygon outside the main image")
+
+    # Fine pass at full resolution inside the padded window
+    keypoints_window, descriptors_window = detect_features(detector, main_gray[y0:y1, x0:x1])
+    good_matches = match_descriptors(descriptors_template, descriptors_window, **match_params)
+    M_window, matches_mask, estimation = find_template_homography(keypoints_template, keypoints_window, good_matches,
+                                                                  min_match_count, homography_estimator)
+    if M_window is None:
+        return full_search("no homography in the full resolution window")
+
+    # Move the window results back to full resolution main image coordinates,
+    # the window offset and the decimation are an affine map (see keypoints_to_full_resolution)
+    sx, sy = main_scale
+    window_to_full = np.array([[1 / sx, 0, (x0 + 0.5) / sx - 0.5],
+                               [0, 1 / sy, (y0 + 0.5) / sy - 0.5],
+                               [0, 0, 1]], dtype=np.float64)
+    M = window_to_full @ M_window
+    keypoints_main = keypoints_to_full_resolution(keypoints_window, main_scale, (x0, y0))
 
-    return result_image, cropped_result, polygon
+    match = TemplateMatch(main_gray, main_scale, template_image, keypoints_template, keypoints_main, good_matches, M,
+                          matches_mask, estimation)
+    result = (*match.render(render_mode, preview_max_size), match.polygon)
+    window = [int(round(x0 / sx)), int(round(y0 / sy)), int(round(x1 / sx)), int(round(y1 / sy))]
+    return (*result, {"path": "coarse_to_fine", "window": window, "estimation": estimation})
 
 
 if __name__ == "__main__":
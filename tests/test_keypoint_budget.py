@@ -0,0 +1,57 @@
+"""
+Tests of the keypoint budget selections on random keypoints.
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feature_cache import KEYPOINT_DTYPE
+from keypoint_budget import grid_top_k
+
+def random_keypoints(count, width=4000, height=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    keypoints = np.zeros(count, dtype=KEYPOINT_DTYPE)
+    keypoints['x'] = rng.uniform(0, width, count)
+    keypoints['y'] = rng.uniform(0, height, count)
+    keypoints['response'] = rng.exponential(0.02, count)
+    return keypoints
+
+def clustered_keypoints(count, seed=0):
+    """
+    Most keypoints in one corner, as in a textured area of an otherwise flat image.
+    """
+    keypoints = random_keypoints(count, seed=seed)
+    cluster = np.arange(count) % 10 != 0
+    keypoints['x'][cluster] /= 20
+    keypoints['y'][cluster] /= 20
+    return keypoints
+
+class GridTopKTest(unittest.TestCase):
+    def test_selects_exactly_the_budget(self):
+        for keypoints in (random_keypoints(20000), clustered_keypoints(20000)):
+            for budget in (1, 10, 255, 256, 1000, 5000, 19999):
+                for grid_size in (1, 4, 16, 64):
+                    selected = grid_top_k(keypoints, budget, grid_size)
+                    self.assertEqual(len(selected), budget, f"budget {budget}, grid size {grid_size}")
+                    self.assertEqual(len(np.unique(selected)), budget)
+
+    def test_single_cell_keeps_the_strongest(self):
+        keypoints = random_keypoints(100)
+        keypoints['x'] = keypoints['x'] / 1000
+        keypoints['y'] = keypoints['y'] / 1000
+        # Every keypoint in one cell of a coarse grid
+        keypoints['x'][0], keypoints['y'][0] = 4000, 3000
+        selected = grid_top_k(keypoints, 10, grid_size=2)
+        self.assertEqual(len(selected), 10)
+        strongest = np.argsort(-keypoints['response'][1:], kind='stable')[:9] + 1
+        self.assertTrue(set(strongest) <= set(selected) | {0})
+
+    def test_keeps_everything_within_the_budget(self):
+        keypoints = random_keypoints(50)
+        np.testing.assert_array_equal(grid_top_k(keypoints, 50), np.arange(50))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+"""
+Tests that a brute force ShardedIndex finds the same 2 nearest neighbours as a single brute force search.
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feature_backends import get_feature_backend
+from template_matching_sift_based import ShardedIndex, knn_search
+
+def random_descriptors(feature_backend, count, rng):
+    if feature_backend.binary:
+        return rng.integers(0, 256, (count, feature_backend.descriptor_size), dtype=np.uint8)
+    return rng.uniform(0, 255, (count, feature_backend.descriptor_size)).astype(np.float32)
+
+class ShardedIndexTest(unittest.TestCase):
+    def assert_same_as_single_search(self, backend_name):
+        feature_backend = get_feature_backend(backend_name, "bruteforce")
+        rng = np.random.default_rng(0)
+        descriptors_main = random_descriptors(feature_backend, 5000, rng)
+        # Some template descriptors are noisy copies of main descriptors, so they have a clear nearest neighbour
+        descriptors_template = random_descriptors(feature_backend, 600, rng)
+        descriptors_template[:300] = descriptors_main[rng.choice(len(descriptors_main), 300, replace=False)]
+        descriptors_template[:300:2, :4] = random_descriptors(feature_backend, 150, rng)[:, :4]
+
+        expected_distances, expected_indices = knn_search(descriptors_template, descriptors_main, None, feature_backend)
+        for shards in (2, 3, 7, 16):
+            index = ShardedIndex(descriptors_main, shards, feature_backend=feature_backend, max_workers=4)
+            distances, indices = index.knn_search(descriptors_template)
+            np.testing.assert_array_equal(distances, expected_distances, f"{backend_name}, {shards} shards")
+            np.testing.assert_array_equal(indices, expected_indices, f"{backend_name}, {shards} shards")
+
+    def test_sift_bruteforce(self):
+        self.assert_same_as_single_search("sift")
+
+    def test_orb_bruteforce(self):
+        self.assert_same_as_single_search("orb")
+
+if __name__ == "__main__":
+    unittest.main()
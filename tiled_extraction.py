@@ -0,0 +1,96 @@
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from concurrent.futures import ProcessPoolExecutor
+import os
+from feature_cache import KEYPOINT_DTYPE, keypoints_to_array
+from utils import read_gray_window
+from feature_backends import get_feature_backend, DEFAULT_FEATURE_BACKEND
+
+# Feature backend and detector of the current worker process, created once by the pool initializer
+_worker_backend = None
+_worker_detector = None
+
+def _init_worker(feature_backend=DEFAULT_FEATURE_BACKEND):
+    global _worker_backend, _worker_detector
+    _worker_backend = get_feature_backend(feature_backend)
+    _worker_detector = _worker_backend.create_detector()
+
+def _detect_tile(args):
+    """
+    Detect features in one tile and keep only those inside the tile core.
+
+    :param args: (image_path, read window, core bounds) where both are (col_off, row_off, width, height).
+    :return: (keypoints array in global coordinates, descriptors).
+    """
+    image_path, (col_off, row_off, width, height), (core_x, core_y, core_w, core_h) = args
+    with rasterio.open(image_path) as dataset:
+        tile = read_gray_window(dataset, Window(col_off, row_off, width, height))
+
+    keypoints, descriptors = _worker_detector.detectAndCompute(tile, None)
+    keypoints = keypoints_to_array(keypoints)
+    if descriptors is None or len(keypoints) == 0:
+        return np.empty(0, dtype=KEYPOINT_DTYPE), _worker_backend.empty_descriptors()
+
+    # Shift keypoints back to global image coordinates
+    keypoints['x'] += col_off
+    keypoints['y'] += row_off
+
+    # Each point of the image belongs to exactly one tile core, so dropping keypoints outside
+    # the core removes duplicates detected twice in the overlap bands
+    keep = ((keypoints['x'] >= core_x) & (keypoints['x'] < core_x + core_w) &
+            (keypoints['y'] >= core_y) & (keypoints['y'] < core_y + core_h))
+    return keypoints[keep], descriptors[keep]
+
+def make_tiles(width, height, tile_size, overlap):
+    """
+    Split an image into tiles with overlapping read windows.
+
+    :param width: Image width.
+    :param height: Image height.
+    :param tile_size: Size of the non-overlapping tile core.
+    :param overlap: Margin added around each core when reading.
+    :return: List of (read window, core bounds), both as (col_off, row_off, width, height).
+    """
+    tiles = []
+    for core_y in range(0, height, tile_size):
+        for core_x in range(0, width, tile_size):
+            core_w = min(tile_size, width - core_x)
+            core_h = min(tile_size, height - core_y)
+            x0 = max(core_x - overlap, 0)
+            y0 = max(core_y - overlap, 0)
+            x1 = min(core_x + core_w + overlap, width)
+            y1 = min(core_y + core_h + overlap, height)
+            tiles.append(((x0, y0, x1 - x0, y1 - y0), (core_x, core_y, core_w, core_h)))
+    return tiles
+
+def detect_features_tiled(image_path, tile_size=4096, overlap=128, max_workers=None, feature_backend=DEFAULT_FEATURE_BACKEND):
+    """
+    Detect features of a large raster tile by tile in a process pool.
+
+    Only one window per worker is held in memory, so peak memory is bounded by the tile size
+    instead of the image size.
+
+    :param image_path: Path to the raster image (any format readable by rasterio).
+    :param tile_size: Size of the tile core in pixels (default: 4096).
+    :param overlap: Margin in pixels read around each tile so features near tile borders are kept (default: 128).
+    :param max_workers: Number of worker processes, defaults to the number of CPUs.
+    :param feature_backend: Name of the feature backend, see feature_backends.get_feature_backend (default: "sift").
+    :return: (keypoints array with KEYPOINT_DTYPE fields, descriptors).
+    """
+    with rasterio.open(image_path) as dataset:
+        width, height = dataset.width, dataset.height
+
+    tiles = make_tiles(width, height, tile_size, overlap)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(tiles)))
+
+    tasks = [(image_path, window, core) for window, core in tiles]
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(feature_backend,)) as executor:
+        results = list(executor.map(_detect_tile, tasks))
+
+    keypoints = np.concatenate([kp for kp, _ in results])
+    descriptors = np.vstack([desc for _, desc in results]).astype(get_feature_backend(feature_backend).descriptor_dtype)
+    print(f"Detected {len(keypoints)} keypoints in {len(tiles)} tiles using {max_workers} workers.")
+    return keypoints, descriptors
@@ -1,61 +1,297 @@
 import rasterio
 from rasterio.transform import from_origin
+from rasterio.enums import Resampling
 from pyproj import Transformer
 from rasterio.errors import RasterioError
+from functools import lru_cache
+import numpy as np
+import cv2
+import math
 import os
 
-def pixel_to_latlon(tiff_path, x, y):
+# cv2.imread flags decoding to grayscale at 1/1, 1/2, 1/4 and 1/8 of the resolution
+_IMREAD_REDUCED_GRAYSCALE = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                             4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+def load_image(image, flags=cv2.IMREAD_COLOR):
     """
-    Convert pixel coordinates to geographic coordinates (latitude, longitude) using a TIFF file.
+    Load an image given as a file path, a decoded array or an encoded buffer (e.g. downloaded into memory).
+
+    Parameters:
+    - image (str | numpy.ndarray | bytes | bytearray | memoryview): Path to the image file, decoded image array,
+      or encoded image content. A 1-D uint8 array is treated as encoded content.
+    - flags (int): cv2.IMREAD_COLOR for a 3-channel BGR image or cv2.IMREAD_GRAYSCALE for a single channel (default: cv2.IMREAD_COLOR).
+
+    Returns:
+    - numpy.ndarray: Decoded image, or None if it cannot be read.
+    """
+    if isinstance(image, str):
+        return cv2.imread(image, flags)
+
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        # Decode from a view of the buffer, without copying it
+        return cv2.imdecode(np.frombuffer(image, dtype=np.uint8), flags)
+
+    if isinstance(image, np.ndarray):
+        if image.ndim == 1:
+            return cv2.imdecode(image, flags)
+        if flags == cv2.IMREAD_GRAYSCALE:
+            if image.ndim == 3:
+                return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+            return image
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        if image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        return image
+
+    print(f"Load image: unsupported image type {type(image).__name__}")
+    return None
+
+# ITU-R BT.601 luma weights of the R, G and B bands, those of cv2.COLOR_RGB2GRAY
+_LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+def _band_to_uint8(band):
+    """
+    Follow cv2.imread behaviour: reduce 16-bit data to 8-bit. The band is modified in place before the 8-bit copy.
+    """
+    if band.dtype == np.uint8:
+        return band
+    if band.dtype == np.uint16:
+        np.right_shift(band, 8, out=band)
+    else:
+        np.clip(band, 0, 255, out=band)
+    return band.astype(np.uint8)
+
+def gray_read_bytes_per_pixel(dataset):
+    """
+    Peak memory of read_gray_window in bytes per output pixel.
+
+    Parameters:
+    - dataset (rasterio.DatasetReader): Opened rasterio dataset.
+
+    Returns:
+    - int: One band as stored and its 8-bit copy, plus the 16-bit accumulator of color rasters.
+    """
+    itemsize = np.dtype(dataset.dtypes[0]).itemsize
+    band_bytes = itemsize + (1 if itemsize > 1 else 0)
+    return band_bytes + 2 if dataset.count >= 3 else band_bytes
+
+def read_gray_window(dataset, window=None, out_shape=None):
+    """
+    Read a window of a raster dataset as a single-channel 8-bit image.
+
+    Color rasters are converted band by band into a 16-bit fixed point accumulator with the luma weights,
+    so only one band is held in memory at a time, see gray_read_bytes_per_pixel.
+
+    Parameters:
+    - dataset (rasterio.DatasetReader): Opened rasterio dataset.
+    - window (rasterio.windows.Window): Window to read, the whole raster when None (default: None).
+    - out_shape (tuple): (height, width) to resample the window to with area averaging, e.g. to read
+      a decimated image (overviews of the file are used when available) (default: None).
+
+    Returns:
+    - numpy.ndarray: Grayscale image (uint8).
+    """
+    read_kwargs = dict(window=window)
+    if out_shape is not None:
+        read_kwargs.update(out_shape=out_shape, resampling=Resampling.average)
+    if dataset.count < 3:
+        return np.ascontiguousarray(_band_to_uint8(dataset.read(1, **read_kwargs)))
+
+    # Luma weights scaled by 256: the weighted sum of 8-bit bands fits into 16 bits
+    gray = None
+    for band_index, weight in zip((1, 2, 3), _LUMA_WEIGHTS):
+        band = _band_to_uint8(dataset.read(band_index, **read_kwargs))
+        if gray is None:
+            gray = cv2.multiply(band, 1, scale=weight * 256, dtype=cv2.CV_16U)
+        else:
+            cv2.addWeighted(gray, 1, band, weight * 256, 0, dst=gray, dtype=cv2.CV_16U)
+        del band
+    return cv2.convertScaleAbs(gray, alpha=1 / 256)
+
+def decimation_factor(width, height, memory_budget_bytes=None, bytes_per_pixel=1):
+    """
+    Get the smallest integer decimation factor keeping the decoding of an image within a memory budget.
+
+    Parameters:
+    - width (int): Image width.
+    - height (int): Image height.
+    - memory_budget_bytes (int): Memory budget of the decoding, no decimation when None (default: None).
+    - bytes_per_pixel (int): Peak bytes per decoded pixel, 1 for the 8-bit result alone (default: 1).
+
+    Returns:
+    - int: Factor dividing both dimensions (1 when the image fits).
+    """
+    if not memory_budget_bytes or width * height * bytes_per_pixel <= memory_budget_bytes:
+        return 1
+    return math.ceil(math.sqrt(width * height * bytes_per_pixel / memory_budget_bytes))
+
+def load_gray_image(image, memory_budget_bytes=None):
+    """
+    Load an image directly as a single-channel 8-bit image, decimated to fit into a memory budget.
+
+    GeoTIFF files are read with rasterio band reads at the reduced size (using the overviews of the file when
+    available). Other files are decoded by OpenCV with IMREAD_GRAYSCALE or IMREAD_REDUCED_GRAYSCALE_2/4/8,
+    and resized further when a larger factor is needed. The color image is never decoded at full resolution.
+
+    Parameters:
+    - image (str | numpy.ndarray | bytes | bytearray | memoryview): Image file path, decoded array or encoded buffer (see load_image).
+    - memory_budget_bytes (int): Budget of the decoded image (1 byte per pixel), no decimation when None (default: None).
+      GeoTIFF reads keep their peak memory within the budget, including the bands being converted
+      (see gray_read_bytes_per_pixel).
+
+    Returns:
+    - gray (numpy.ndarray): Grayscale image (uint8), or None if it cannot be read.
+    - scale (tuple): (scale_x, scale_y) from full resolution to the loaded image, (1.0, 1.0) without decimation.
+      Divide loaded image coordinates by the scale to get full resolution pixel coordinates.
+    """
+    width = height = None
+    if isinstance(image, str):
+        try:
+            with rasterio.open(image) as dataset:
+                width, height = dataset.width, dataset.height
+                if dataset.driver == 'GTiff':
+                    factor = decimation_factor(width, height, memory_budget_bytes, gray_read_bytes_per_pixel(dataset))
+                    out_shape = None if factor == 1 else (max(height // factor, 1), max(width // factor, 1))
+                    gray = read_gray_window(dataset, out_shape=out_shape)
+                    return gray, (gray.shape[1] / width, gray.shape[0] / height)
+        except RasterioError:
+            pass
+
+    if width is not None:
+        # Decode at the largest reduction OpenCV supports without going below the target size
+        factor = decimation_factor(width, height, memory_budget_bytes)
+        reduction = max(r for r in _IMREAD_REDUCED_GRAYSCALE if r <= factor)
+        gray = cv2.imread(image, _IMREAD_REDUCED_GRAYSCALE[reduction])
+    else:
+        gray = load_image(image, cv2.IMREAD_GRAYSCALE)
+        if gray is not None:
+            height, width = gray.shape[:2]
+            factor = decimation_factor(width, height, memory_budget_bytes)
+    if gray is None:
+        return None, None
+
+    if factor > 1:
+        target_size = (max(width // factor, 1), max(height // factor, 1))
+        if (gray.shape[1], gray.shape[0]) != target_size:
+            gray = cv2.resize(gray, target_size, interpolation=cv2.INTER_AREA)
+    return gray, (gray.shape[1] / width, gray.shape[0] / height)
+
+def get_image_size(image_path):
+    """
+    Read the size of an image file from its header, without decoding the pixels.
+
+    Parameters:
+    - image_path (str): Image file path (any format readable by rasterio).
+
+    Returns:
+    - tuple: (width, height), or None if the file cannot be read.
+    """
+    try:
+        with rasterio.open(image_path) as dataset:
+            return dataset.width, dataset.height
+    except RasterioError:
+        print(f"Cannot read image '{image_path}'")
+        return None
+
+@lru_cache(maxsize=32)
+def _read_raster_metadata(tiff_path, mtime):
+    """
+    Read the affine transform and CRS of a raster. Cached by path and modification time,
+    so a file replaced on disk is read again.
+    """
+    with rasterio.open(tiff_path) as dataset:
+        return dataset.transform, dataset.crs
+
+def get_raster_metadata(tiff_path):
+    """
+    Get the affine transform and CRS of a raster, reusing the metadata of previous calls.
 
     Parameters:
     - tiff_path (str): Path to the TIFF file.
-    - x (int): Pixel x-coordinate.
-    - y (int): Pixel y-coordinate.
 
     Returns:
-    - tuple: (latitude, longitude) coordinates, or (None, None) if there is an error.
+    - tuple: (affine transform, CRS).
+    """
+    return _read_raster_metadata(tiff_path, os.path.getmtime(tiff_path))
+
+@lru_cache(maxsize=16)
+def get_transformer_to_wgs84(crs_wkt):
+    """
+    Get a transformer from a CRS to WGS84 (lat/lon), created once per CRS.
+
+    Parameters:
+    - crs_wkt (str): Source CRS in WKT format.
+
+    Returns:
+    - pyproj.Transformer: Transformer with (x, y) -> (lon, lat) axis order.
+    """
+    return Transformer.from_crs(crs_wkt, 'EPSG:4326', always_xy=True)
+
+def pixels_to_latlon(tiff_path, points):
+    """
+    Convert many pixel coordinates to geographic coordinates (latitude, longitude) at once.
+
+    Parameters:
+    - tiff_path (str): Path to the TIFF file.
+    - points (array-like): Pixel coordinates (x, y), any shape ending with 2 (e.g. (N, 2) or OpenCV (N, 1, 2)).
+
+    Returns:
+    - numpy.ndarray: (N, 2) array of (latitude, longitude), or None if there is an error.
     """
     if not os.path.exists(tiff_path):
-        return None, None
-    
+        return None
+
     try:
-        with rasterio.open(tiff_path) as dataset:
-            # Read the affine transform and CRS
-            transform = dataset.transform
-            crs = dataset.crs
-            
-            # Ensure CRS is defined
-            if crs is None:
-                print("Pixel to latlon: Not crs data")
-                return None, None
-            
-            # Convert pixel coordinates to geographic coordinates
-            lon, lat = rasterio.transform.xy(transform, y, x)
-            
-            # Create a transformer to convert from the dataset's CRS to WGS84 (lat/lon)
-            transformer = Transformer.from_crs(crs, 'EPSG:4326', always_xy=True)
-            
-            # Transform the coordinates
-            lon, lat = transformer.transform(lon, lat)
-            
-            return lat, lon
+        # Read the affine transform and CRS
+        transform, crs = get_raster_metadata(tiff_path)
+
+        # Ensure CRS is defined
+        if crs is None:
+            print("Pixel to latlon: Not crs data")
+            return None
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        # Convert pixel coordinates (centers) to the dataset's CRS coordinates
+        xs, ys = transform * (points[:, 0] + 0.5, points[:, 1] + 0.5)
+
+        # Transform the coordinates to WGS84
+        lon, lat = get_transformer_to_wgs84(crs.to_wkt()).transform(xs, ys)
+
+        return np.column_stack([lat, lon])
 
     except (RasterioError, ValueError) as e:
         print(f"Pixel to latlon: Error reading TIFF file or processing coordinates: {e}")
-        return None, None
+        return None
     except Exception as e:
         print(f"Pixel to latlon: An unexpected error occurred: {e}")
+        return None
+
+def pixel_to_latlon(tiff_path, x, y):
+    """
+    Convert pixel coordinates to geographic coordinates (latitude, longitude) using a TIFF file.
+
+    Parameters:
+    - tiff_path (str): Path to the TIFF file.
+    - x (int): Pixel x-coordinate.
+    - y (int): Pixel y-coordinate.
+
+    Returns:
+    - tuple: (latitude, longitude) coordinates, or (None, None) if there is an error.
+    """
+    latlon = pixels_to_latlon(tiff_path, [[x, y]])
+    if latlon is None:
         return None, None
+    lat, lon = latlon[0]
+    return float(lat), float(lon)
     
 def polygon_to_latlon(tiff_path, polygon):
     latlon_polygon = []
-    if polygon is None:
+    # Images loaded from memory have no georeference
+    if polygon is None or not isinstance(tiff_path, str):
+        return latlon_polygon
+    latlon = pixels_to_latlon(tiff_path, polygon)
+    if latlon is None:
         return latlon_polygon
-    for point in polygon:
-        x, y = point[0]
-        lat, lon = pixel_to_latlon(tiff_path, x, y)
-        if lat is None:
-            continue
-        latlon_polygon.append([lat, lon])
-    return latlon_polygon
\ No newline at end of file
+    return latlon.tolist()